@@ -0,0 +1,52 @@
+"""The mail accounts to check."""
+
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from get_secrets import secrets
+
+
+@dataclass(frozen=True)
+class Account:
+    """
+    A mail account on a platform ("gmail" or "gmx").
+
+    The default account has no name and uses the original secrets and cache files. The other accounts are listed in
+    the `GMAIL_ACCOUNTS` and `GMX_ACCOUNTS` secrets (comma-separated names, "default" for the default account) and
+    their secrets contain their name (e.g. `GMX_ALICE_USER` or `GOOGLE_ALICE_REFRESH_TOKEN`).
+    """
+
+    provider: str
+    name: str = ""
+
+    def __post_init__(self):
+        if not re.fullmatch(r"[a-z0-9]*", self.name):
+            raise ValueError(f"Invalid account name: {self.name!r} (only lowercase letters and digits are allowed)")
+
+    @property
+    def platform(self):
+        """The platform of the messages of this account (the prefix of their hashed IDs)."""
+        return f"{self.provider}-{self.name}" if self.name else self.provider
+
+    @property
+    def cache_dir(self):
+        """The directory containing the cached data of this account."""
+        cache_dir = Path(__file__).parent / "cache"
+        return cache_dir / self.platform if self.name else cache_dir
+
+    def secret(self, key: str) -> str:
+        """Return a secret of this account (e.g. `secret("USER")`)."""
+        if self.name:
+            return secrets[f"{self.provider.upper()}_{self.name.upper()}_{key}"]
+        return secrets[f"{self.provider.upper()}_{key}"]
+
+
+def get_accounts(provider: str) -> list[Account]:
+    """Return the accounts configured for a platform."""
+    names = secrets.get(f"{provider.upper()}_ACCOUNTS", "default")
+    return [
+        Account(provider, "" if name == "default" else name)
+        for name in (name.strip().lower() for name in names.split(","))
+        if name
+    ]
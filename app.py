@@ -15,13 +15,20 @@ if not find_spec("nacl"):
 import datetime as dt
 import hashlib
 import imaplib
+import json
+import queue
 import re
+import threading
+import time
+import traceback
 import uuid
 from base64 import b64encode
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from html import escape
 from pathlib import Path
 from time import sleep
+from typing import ClassVar
 from urllib.parse import urlencode
 
 from flask import Flask, Response, abort, redirect, render_template, request, session, url_for
@@ -76,37 +83,111 @@ Provider(
 Provider("gmx", "GMX", "GMX_2018_logo.svg", ("", ""), ("", "", "", ""))
 
 
-app.before_request(secrets.reload)
+# Reload the secrets if another process (e.g. `main.py`) has modified them
+app.before_request(secrets.reload_if_changed)
 
+# The results of the provider checks are refreshed in the background after this number of seconds
+PROVIDER_CHECK_TTL = 60
 
-@app.route("/")
-def index():
-    """Home page."""
-    providers_ok = {}
 
-    for provider in providers.values():
-        if provider.id == "gmx":
-            ok = secrets.get(f"{provider.id.upper()}_USER") and secrets.get(f"{provider.id.upper()}_PASSWORD")
-            if ok:
+def check_provider(provider: Provider) -> bool:
+    """Return True if a provider is set up and its credentials work, False otherwise."""
+    if provider.id == "gmx":
+        ok = bool(secrets.get(f"{provider.id.upper()}_USER") and secrets.get(f"{provider.id.upper()}_PASSWORD"))
+        if ok:
+            try:
                 conn = imaplib.IMAP4_SSL("imap.gmx.com")
-                try:
-                    conn.login(
-                        secrets.get(f"{provider.id.upper()}_USER", ""),
-                        secrets.get(f"{provider.id.upper()}_PASSWORD", ""),
-                    )
-                except imaplib.IMAP4.error:
-                    ok = False
-                finally:
-                    conn.logout()
-        else:
-            ok = secrets.get(f"{provider.id.upper()}_CLIENT_ID") and secrets.get(f"{provider.id.upper()}_CLIENT_SECRET")
-            if ok:
-                try:
-                    Token.for_provider(provider.id)
-                except (RuntimeError, ValueError):
-                    ok = False
-        providers_ok[provider.id] = ok
+            except OSError:
+                return False
+            try:
+                conn.login(
+                    secrets.get(f"{provider.id.upper()}_USER", ""),
+                    secrets.get(f"{provider.id.upper()}_PASSWORD", ""),
+                )
+            except (imaplib.IMAP4.error, OSError):
+                ok = False
+            finally:
+                conn.logout()
+        return ok
+
+    ok = bool(secrets.get(f"{provider.id.upper()}_CLIENT_ID") and secrets.get(f"{provider.id.upper()}_CLIENT_SECRET"))
+    if ok:
+        try:
+            Token.for_provider(provider.id)
+        except (RuntimeError, ValueError, OSError):
+            ok = False
+    return ok
+
+
+class ProviderChecks:
+    """
+    Check the providers concurrently and cache the results.
+
+    A result is used until its secrets change. After `ttl` seconds, it is refreshed in the background (the old result
+    is returned in the meantime).
+    """
+
+    def __init__(self, ttl: float = PROVIDER_CHECK_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # The last result of each provider: (secrets fingerprint, monotonic time of the check, result)
+        self.results: dict[str, tuple[str, float, bool]] = {}
+        # The running checks, by provider ID and secrets fingerprint
+        self.running: dict[tuple[str, str], Future[bool]] = {}
+        self.executor = ThreadPoolExecutor(thread_name_prefix="provider-check")
+
+    @staticmethod
+    def fingerprint(provider: Provider) -> str:
+        """Return a hash of the secrets and token file of a provider (to check it again when they change)."""
+        prefix = f"{provider.id.upper()}_"
+        token_file = Token.file_for_provider(provider.id)
+        data = [
+            *sorted((key, value) for key, value in secrets.items() if key.startswith(prefix)),
+            token_file.stat().st_mtime_ns if token_file.exists() else None,
+        ]
+        return hashlib.sha256(repr(data).encode()).hexdigest()
+
+    def _check(self, provider: Provider, fingerprint: str) -> bool:
+        try:
+            ok = check_provider(provider)
+        except BaseException:
+            with self.lock:
+                self.running.pop((provider.id, fingerprint), None)
+            raise
+        with self.lock:
+            self.results[provider.id] = (fingerprint, time.monotonic(), ok)
+            self.running.pop((provider.id, fingerprint), None)
+        return ok
+
+    def get(self) -> dict[str, bool]:
+        """Return the result of each provider, waiting only for the ones that have no valid result."""
+        waiting: dict[str, Future[bool]] = {}
+        results = {}
+        with self.lock:
+            for provider in providers.values():
+                fingerprint = self.fingerprint(provider)
+                result = self.results.get(provider.id)
+                if result and result[0] == fingerprint:
+                    results[provider.id] = result[2]
+                    if time.monotonic() - result[1] < self.ttl:
+                        continue
+                key = (provider.id, fingerprint)
+                if key not in self.running:
+                    self.running[key] = self.executor.submit(self._check, provider, fingerprint)
+                if provider.id not in results:
+                    waiting[provider.id] = self.running[key]
+        for provider_id, future in waiting.items():
+            results[provider_id] = future.result()
+        return results
+
+
+provider_checks = ProviderChecks()
+
 
+@app.route("/")
+def index():
+    """Home page."""
+    providers_ok = provider_checks.get()
     all_ok = all(providers_ok.values())
 
     return render_template("index.html", providers=providers.values(), providers_ok=providers_ok, all_ok=all_ok)
@@ -121,13 +202,15 @@ def favicon():
 @app.route("/gmx", methods=["GET", "POST"])
 def gmx():
     if "delete" in request.form:
-        secrets.pop("GMX_USER", "")
-        secrets.pop("GMX_PASSWORD", "")
+        with secrets.batch():
+            secrets.pop("GMX_USER", "")
+            secrets.pop("GMX_PASSWORD", "")
         return redirect("/gmx")
 
     if request.method == "POST":
-        secrets["GMX_USER"] = request.form["email"]
-        secrets["GMX_PASSWORD"] = request.form["password"]
+        with secrets.batch():
+            secrets["GMX_USER"] = request.form["email"]
+            secrets["GMX_PASSWORD"] = request.form["password"]
         return redirect("/gmx")
 
     gmx_user = secrets.get("GMX_USER", "")
@@ -174,8 +257,9 @@ def provider_oauth(provider_name):
         Token.delete(provider.id)
 
     if request.method == "POST" and ("client_id" in request.form or "client_secret" in request.form):
-        secrets[f"{provider.id.upper()}_CLIENT_ID"] = request.form["client_id"]
-        secrets[f"{provider.id.upper()}_CLIENT_SECRET"] = request.form["client_secret"]
+        with secrets.batch():
+            secrets[f"{provider.id.upper()}_CLIENT_ID"] = request.form["client_id"]
+            secrets[f"{provider.id.upper()}_CLIENT_SECRET"] = request.form["client_secret"]
         return redirect(f"/{provider.id}")
 
     # Get the settings
@@ -333,33 +417,94 @@ page, find your Google app and revoke the access.
     return redirect(f"/{provider}")
 
 
+# The hashes of the secrets uploaded to GitHub, by repository (to skip the unchanged ones)
+UPLOADED_SECRETS_FILE = Path(__file__).parent / "cache/.github_secrets.json"
+# The maximum number of secrets uploaded at the same time
+MAX_CONCURRENT_UPLOADS = 8
+# The delays between the requests that look for the workflow run (in seconds)
+WORKFLOW_RUN_POLL_DELAYS = (0.5, 0.5, 1, 1, 2, 2, 3, 5, 5, 5)
+
+
+def secret_hash(repo_url_part: str, key: str, value: str):
+    """Return the hash of a secret uploaded to a repository."""
+    return hashlib.sha256(f"{repo_url_part}\0{key}\0{value}".encode()).hexdigest()
+
+
+def upload_secrets(repo_url_part: str, token: str):
+    """Upload the secrets that have changed since the last upload to the GitHub repository."""
+    import asyncio  # pylint: disable=C0415
+
+    api_url = f"https://api.github.com/repos/{repo_url_part}/actions/secrets"
+    uploaded: dict[str, dict[str, str]] = (
+        json.loads(UPLOADED_SECRETS_FILE.read_text("utf-8")) if UPLOADED_SECRETS_FILE.exists() else {}
+    )
+    hashes = uploaded.setdefault(repo_url_part, {})
+    # A secret may have been deleted on GitHub: only skip the ones that still exist
+    data = custom_requests.get(api_url, {"per_page": 100}, token=token).json()
+    existing = {secret["name"] for secret in data["secrets"]}
+    to_upload = {
+        key: value
+        for key, value in secrets.items()
+        if key not in existing or hashes.get(key) != secret_hash(repo_url_part, key, value)
+    }
+    print(f"Uploading {len(to_upload)} secrets ({len(secrets) - len(to_upload)} unchanged)")
+    if not to_upload:
+        return
+
+    # https://docs.github.com/fr/rest/guides/encrypting-secrets-for-the-rest-api#example-encrypting-a-secret-using-python
+    public_key = custom_requests.get(f"{api_url}/public-key", token=token).json()
+    # Create the sealed box once for all the secrets
+    pkey = public.PublicKey(public_key["key"].encode("utf-8"), encoding.Base64Encoder())  # type: ignore
+    sealed_box = public.SealedBox(pkey)
+
+    async def upload_all():
+        async with custom_requests.AsyncClient(limit_per_host=MAX_CONCURRENT_UPLOADS) as client:
+
+            async def upload(key: str, value: str):
+                encrypted_value = b64encode(sealed_box.encrypt(value.encode("utf-8"))).decode(errors="replace")
+                await client.put(
+                    f"{api_url}/{key}",
+                    json={"encrypted_value": encrypted_value, "key_id": public_key["key_id"]},
+                    token=token,
+                )
+                hashes[key] = secret_hash(repo_url_part, key, value)
+
+            await asyncio.gather(*(upload(key, value) for key, value in to_upload.items()))
+
+    try:
+        asyncio.run(upload_all())
+    finally:
+        # Save the hashes of the secrets that have been uploaded, even if some uploads failed
+        UPLOADED_SECRETS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        UPLOADED_SECRETS_FILE.write_text(json.dumps(uploaded), "utf-8")
+
+
+def get_workflow_run_id(repo_url_part: str, token: str) -> int:
+    """Return the ID of the workflow run that has just been started, polling more slowly as time passes."""
+    for delay in WORKFLOW_RUN_POLL_DELAYS:
+        sleep(delay)
+        data = custom_requests.get(
+            f"https://api.github.com/repos/{repo_url_part}/actions/runs?event=workflow_dispatch&per_page=1",
+            token=token,
+        ).json()
+        try:
+            date = dt.datetime.fromisoformat(data["workflow_runs"][0]["created_at"])
+            if date + dt.timedelta(seconds=30) >= dt.datetime.now(dt.UTC):
+                return data["workflow_runs"][0]["id"]
+        except (IndexError, KeyError):
+            pass
+    raise ValueError("Could not get the workflow URL")
+
+
 @app.route("/secrets", methods=["GET", "POST"])
 def add_secrets():
     if request.method == "POST":
-        # https://docs.github.com/fr/rest/guides/encrypting-secrets-for-the-rest-api#example-encrypting-a-secret-using-python
-        def encrypt(public_key: str, secret_value: str) -> str:
-            """Encrypt a Unicode string using the public key."""
-            pkey = public.PublicKey(public_key.encode("utf-8"), encoding.Base64Encoder())  # type: ignore
-            sealed_box = public.SealedBox(pkey)
-            encrypted = sealed_box.encrypt(secret_value.encode("utf-8"))
-            return b64encode(encrypted).decode(errors="replace")
-
         token = request.form["token"]
         session["GITHUB_PAT"] = token
         repo_url_part = (re.search(r"^.*/(.*?/.*?)$", request.form["repo_url"].rstrip("/")) or ["", ""])[1]
         session["REPO_URL_PART"] = repo_url_part
 
-        data = custom_requests.get(
-            f"https://api.github.com/repos/{repo_url_part}/actions/secrets/public-key", token=token
-        ).json()
-
-        for key, value in secrets.items():
-            encrypted_value = encrypt(data["key"], value)
-            custom_requests.put(
-                f"https://api.github.com/repos/{repo_url_part}/actions/secrets/{key}",
-                json={"encrypted_value": encrypted_value, "key_id": data["key_id"]},
-                token=token,
-            )
+        upload_secrets(repo_url_part, token)
 
         custom_requests.post(
             f"https://api.github.com/repos/{repo_url_part}/actions/workflows/automation.yml/dispatches",
@@ -367,21 +512,7 @@ def add_secrets():
             token=token,
         )
 
-        for _ in range(3):
-            sleep(5)
-            data = custom_requests.get(
-                f"https://api.github.com/repos/{repo_url_part}/actions/runs?event=workflow_dispatch&per_page=1",
-                token=token,
-            ).json()
-            try:
-                date = dt.datetime.fromisoformat(data["workflow_runs"][0]["created_at"])
-                if date + dt.timedelta(seconds=30) >= dt.datetime.now(dt.UTC):
-                    session["WORKFLOW_RUN_ID"] = data["workflow_runs"][0]["id"]
-                    break
-            except (IndexError, KeyError):
-                pass
-        else:
-            raise ValueError("Could not get the workflow URL")
+        session["WORKFLOW_RUN_ID"] = get_workflow_run_id(repo_url_part, token)
 
         return redirect("/end")
 
@@ -393,17 +524,137 @@ def end():
     return render_template("end.html")
 
 
-@app.route("/status")
-def status():
+# The delays between the requests to GitHub while the status of a workflow run doesn't change (in seconds)
+MIN_STATUS_POLL_DELAY = 2
+MAX_STATUS_POLL_DELAY = 15
+# The time between two comments sent to keep the event streams open (in seconds)
+STREAM_KEEP_ALIVE = 15
+
+
+class WorkflowRunWatcher:
+    """
+    Poll the status of a workflow run from one background thread and send its changes to all the subscribers.
+
+    The requests are conditional (with the ETag of the last response) and slow down while the status doesn't change.
+    """
+
+    # The watchers, by repository and workflow run ID
+    watchers: ClassVar[dict[tuple[str, str], "WorkflowRunWatcher"]] = {}
+    watchers_lock = threading.Lock()
+
+    def __init__(self, repo_url_part: str, workflow_run_id: str, token: str):
+        self.url = f"https://api.github.com/repos/{repo_url_part}/actions/runs/{workflow_run_id}/jobs"
+        self.token = token
+        self.lock = threading.Lock()
+        self.subscribers: list[queue.Queue] = []
+        # The last status sent to the subscribers
+        self.status: dict | None = None
+        self.received = threading.Event()
+        self.etag = ""
+        self.thread = threading.Thread(target=self.poll, daemon=True)
+
+    @classmethod
+    def get(cls, repo_url_part: str, workflow_run_id: str, token: str):
+        """Return the watcher of a workflow run, starting it if needed."""
+        with cls.watchers_lock:
+            watcher = cls.watchers.get((repo_url_part, workflow_run_id))
+            if watcher is None or not watcher.thread.is_alive() and not watcher.done:
+                watcher = cls.watchers[(repo_url_part, workflow_run_id)] = cls(repo_url_part, workflow_run_id, token)
+                watcher.thread.start()
+            return watcher
+
+    @property
+    def done(self):
+        """True if the workflow run has finished, False otherwise."""
+        return bool(self.status and self.status["status"] == "completed")
+
+    def subscribe(self) -> queue.Queue:
+        """Return a queue that receives the current status and its changes."""
+        subscriber: queue.Queue = queue.Queue()
+        with self.lock:
+            if self.status:
+                subscriber.put(self.status)
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self.lock:
+            self.subscribers.remove(subscriber)
+
+    def poll(self):
+        """Get the status until the workflow run finishes."""
+        delay = MIN_STATUS_POLL_DELAY
+        while not self.done:
+            try:
+                response = custom_requests.get(
+                    self.url, headers={"If-None-Match": self.etag} if self.etag else None, token=self.token
+                )
+            except OSError as err:
+                # A 304 response means that the status hasn't changed (and doesn't count in the rate limit)
+                if getattr(err, "code", None) != 304:
+                    traceback.print_exception(err)
+                delay = min(delay * 2, MAX_STATUS_POLL_DELAY)
+            else:
+                self.etag = response.headers.get("ETag", "")
+                jobs = response.json().get("jobs")
+                # The job may not be created yet
+                status = jobs and {
+                    "status": jobs[0]["status"],
+                    "conclusion": jobs[0]["conclusion"],
+                    "job_url": jobs[0]["html_url"],
+                }
+                if status and status != self.status:
+                    with self.lock:
+                        self.status = status
+                        for subscriber in self.subscribers:
+                            subscriber.put(status)
+                    self.received.set()
+                    delay = MIN_STATUS_POLL_DELAY
+                else:
+                    delay = min(delay * 2, MAX_STATUS_POLL_DELAY)
+            if not self.done:
+                time.sleep(delay)
+
+
+def get_workflow_run_watcher():
+    """Return the watcher of the workflow run of the current session."""
     repo_url_part = session.get("REPO_URL_PART", "")
     token = session.get("GITHUB_PAT", "")
     workflow_run_id = session.get("WORKFLOW_RUN_ID", "")
     if not token or not workflow_run_id:
         abort(404)
-    data = custom_requests.get(
-        f"https://api.github.com/repos/{repo_url_part}/actions/runs/{workflow_run_id}/jobs", token=token
-    ).json()["jobs"][0]
-    return Response(to_json({"status": data["status"], "conclusion": data["conclusion"], "job_url": data["html_url"]}))
+    return WorkflowRunWatcher.get(repo_url_part, str(workflow_run_id), token)
+
+
+@app.route("/status")
+def status():
+    watcher = get_workflow_run_watcher()
+    if not watcher.received.wait(MAX_STATUS_POLL_DELAY * 2):
+        abort(504)
+    return Response(to_json(watcher.status))
+
+
+@app.route("/status/stream")
+def status_stream():
+    """Send the status of the workflow run and its changes as server-sent events."""
+    watcher = get_workflow_run_watcher()
+
+    def events():
+        subscriber = watcher.subscribe()
+        try:
+            while True:
+                try:
+                    status = subscriber.get(timeout=STREAM_KEEP_ALIVE)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {to_json(status)}\n\n"
+                if status["status"] == "completed":
+                    return
+        finally:
+            watcher.unsubscribe(subscriber)
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,89 @@
+"""Run `main.py` once against the fake servers and print the measurements as JSON.
+
+This script is started in a subprocess by `benchmarks/run.py` so that every scenario gets a fresh interpreter
+(cold start, clean peak RSS) and works on a copy of the code with its own `cache/` directory.
+"""
+
+import contextlib
+import imaplib
+import io
+import json
+import os
+import resource
+import sys
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+
+def peak_rss() -> int:
+    """Return the peak RSS of the current process in bytes."""
+    # ru_maxrss can include the peak RSS of the parent process on Linux, VmHWM is reset by exec
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RedirectHandler(urllib.request.BaseHandler):
+    """Send the requests for the real hosts to the local fake servers."""
+
+    def __init__(self, hosts: dict[str, str]):
+        self.hosts = hosts
+
+    def https_request(self, req: urllib.request.Request):
+        url = urlsplit(req.full_url)
+        if url.hostname in self.hosts:
+            req.full_url = self.hosts[url.hostname] + url.path + ("?" + url.query if url.query else "")
+        return req
+
+    http_request = https_request
+
+
+def main():
+    config = json.loads(os.environ["BENCHMARK_CONFIG"])
+    sys.path.insert(0, config["code_dir"])
+
+    start = time.perf_counter()
+
+    urllib.request.install_opener(urllib.request.build_opener(RedirectHandler(config["hosts"])))
+    imaplib.IMAP4_SSL = lambda *args, **kwargs: imaplib.IMAP4("127.0.0.1", config["imap_port"])  # type: ignore
+
+    import custom_requests  # pylint: disable=C0415
+    import main as automation  # pylint: disable=C0415
+    import send_email  # pylint: disable=C0415
+    from stats import stats  # pylint: disable=C0415
+
+    # Same for the asyncio client
+    open_connection = custom_requests.AsyncClient.open_connection
+
+    async def redirect_connection(self, scheme, host, port):
+        if host in config["hosts"]:
+            url = urlsplit(config["hosts"][host])
+            return await open_connection(self, url.scheme, url.hostname, url.port)
+        return await open_connection(self, scheme, host, port)
+
+    custom_requests.AsyncClient.open_connection = redirect_connection  # type: ignore
+
+    # Never send real error emails from a benchmark
+    send_email.mailer = send_email.Mailer("127.0.0.1", config["smtp_port"], use_ssl=False)
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        automation.run()
+
+    print(
+        json.dumps({
+            "wall_time": time.perf_counter() - start,
+            "peak_rss": peak_rss(),
+            "stats": stats.summary(),
+        })
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+"""Local fake servers for the Gmail REST API, a GMX IMAP server, a GMX SMTP server and the Todoist sync API."""
+
+import base64
+import email
+import email.message
+import functools
+import json
+import re
+import socketserver
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    """A threaded HTTP server that counts its requests."""
+
+    daemon_threads = True
+    # Accept many concurrent connections (the default backlog of 5 delays the others by 1 second)
+    request_queue_size = 128
+
+    def __init__(self, latency: float = 0):
+        super().__init__(("127.0.0.1", 0), self.Handler)
+        self.lock = threading.Lock()
+        self.requests: dict[str, int] = defaultdict(int)
+        self.bytes_sent = 0
+        # The time to wait before each response (in seconds), to simulate the network
+        self.latency = latency
+
+    @property
+    def url(self):
+        """The base URL of the server."""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        """Start serving in a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def route(self, method: str, path: str, query: dict[str, str], body: bytes) -> tuple[int, object]:
+        """Return the status code and the JSON data for a request."""
+        raise NotImplementedError
+
+    class Handler(BaseHTTPRequestHandler):
+        """Dispatch the requests to the `route` method of the server."""
+
+        server: "FakeHTTPServer"
+        protocol_version = "HTTP/1.1"
+        # The headers and the body are written separately, don't delay the body on kept-alive connections
+        disable_nagle_algorithm = True
+
+        def handle_request(self, method):
+            url = urlsplit(self.path)
+            query = {key: value[-1] for key, value in parse_qs(url.query).items()}
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            time.sleep(self.server.latency)
+            with self.server.lock:
+                self.server.requests[f"{method} {re.sub(r'/[0-9a-z]{8,}$', '/{id}', url.path)}"] += 1
+                status, data = self.server.route(method, url.path, query, body)
+                content = json.dumps(data).encode()
+                self.server.bytes_sent += len(content)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):  # pylint: disable=C0103
+            self.handle_request("GET")
+
+        def do_POST(self):  # pylint: disable=C0103
+            self.handle_request("POST")
+
+        def log_message(self, format, *args):  # pylint: disable=W0622
+            pass
+
+
+class FakeGoogle(FakeHTTPServer):
+    """A fake for the Gmail REST API and the Google OAuth endpoints."""
+
+    PAGE_SIZE = 100
+
+    def __init__(self, mailbox: dict[str, bytes], latency: float = 0):
+        super().__init__(latency)
+        self.mailbox = dict(mailbox)
+        self.history_id = 1000
+        # The history records (ID, type, message ID)
+        self.history: list[tuple[int, str, str]] = []
+
+    def add_message(self, id: str, data: bytes):
+        """Add a message to the inbox."""
+        with self.lock:
+            self.mailbox[id] = data
+            self.history_id += 1
+            self.history.append((self.history_id, "messagesAdded", id))
+
+    def remove_message(self, id: str):
+        """Remove a message from the inbox."""
+        with self.lock:
+            del self.mailbox[id]
+            self.history_id += 1
+            self.history.append((self.history_id, "messagesDeleted", id))
+
+    def page(self, values: list, query: dict[str, str]):
+        """Return a page of `values` and the next page token."""
+        start = int(query.get("pageToken") or 0)
+        end = start + min(int(query.get("maxResults") or self.PAGE_SIZE), 500)
+        return values[start:end], (str(end) if end < len(values) else None)
+
+    def route(self, method, path, query, body):
+        if path == "/tokeninfo":
+            return 200, {"expires_in": "3599", "scope": "https://www.googleapis.com/auth/gmail.readonly"}
+        if path == "/token":
+            return 200, {"access_token": "fake-google-token", "expires_in": 3599}
+
+        if path == "/gmail/v1/users/me/profile":
+            return 200, {"emailAddress": "me@example.com", "historyId": str(self.history_id)}
+
+        if path == "/gmail/v1/users/me/history":
+            start = int(query["startHistoryId"])
+            if self.history and start < self.history[0][0] - 1:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            records = [
+                {"id": str(id), type: [{"message": {"id": message_id, "labelIds": ["INBOX"]}}]}
+                for id, type, message_id in self.history
+                if id > start
+            ]
+            records, next_page_token = self.page(records, query)
+            data = {"history": records, "historyId": str(self.history_id)}
+            if next_page_token:
+                data["nextPageToken"] = next_page_token
+            return 200, data
+
+        if path == "/gmail/v1/users/me/messages":
+            messages, next_page_token = self.page([{"id": id, "threadId": id} for id in self.mailbox], query)
+            data: dict = {"messages": messages, "resultSizeEstimate": len(self.mailbox)}
+            if next_page_token:
+                data["nextPageToken"] = next_page_token
+            return 200, data
+
+        match = re.fullmatch(r"/gmail/v1/users/me/messages/(\w+)", path)
+        if match and match[1] in self.mailbox:
+            return 200, {"id": match[1], "raw": base64.urlsafe_b64encode(self.mailbox[match[1]]).decode()}
+
+        return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+
+class FakeTodoist(FakeHTTPServer):
+    """A fake for the Todoist sync API."""
+
+    def __init__(self, tasks: list[dict], latency: float = 0):
+        super().__init__(latency)
+        self.version = 0
+        self.next_id = 1
+        self.objects: dict[str, dict[str, dict]] = {"items": {}, "notes": {}}
+        for i, task in enumerate(tasks):
+            item_id = self.add("items", task)
+            if i % 10 == 0:
+                self.add("notes", {"item_id": item_id, "content": f"Note on {task['content']}"})
+
+    def add(self, key: str, data: dict):
+        """Add an object to the account and return its ID."""
+        id = f"{self.next_id:016x}"
+        self.next_id += 1
+        self.objects[key][id] = {
+            "id": id,
+            "user_id": "1",
+            "project_id": "6Jf8VQXxpwv56VQ7",
+            "added_at": "2024-01-01T00:00:00.000000Z",
+            "is_deleted": False,
+            **({"checked": False, "labels": [], "child_order": self.next_id} if key == "items" else {}),
+            # The add commands contain the temporary ID
+            **{k: v for k, v in data.items() if k != "id"},
+        }
+        self.touch(key, id)
+        return id
+
+    def touch(self, key: str, id: str):
+        """Mark an object as changed."""
+        self.version += 1
+        self.objects[key][id]["_version"] = self.version
+
+    def route(self, method, path, query, body):
+        if path == "/api/v1/user":
+            return 200, {"id": "1", "email": "me@example.com"}
+        if path != "/api/v1/sync":
+            return 404, {"error": "Not Found"}
+
+        form = {key: value[-1] for key, value in parse_qs(body.decode()).items()}
+        commands = json.loads(form.get("commands", "[]"))
+        resource_types = json.loads(form.get("resource_types", '["all"]'))
+        sync_token = form.get("sync_token", "*")
+
+        temp_id_mapping = {}
+        sync_status = {}
+        for command in commands:
+            args = command["args"]
+            object_type, _, action = command["type"].partition("_")
+            key = {"item": "items", "note": "notes"}[object_type]
+            id = temp_id_mapping.get(args.get("id"), args.get("id"))
+            if action == "add":
+                if "item_id" in args:
+                    args = {**args, "item_id": temp_id_mapping.get(args["item_id"], args["item_id"])}
+                temp_id_mapping[command["temp_id"]] = self.add(key, args)
+            elif id not in self.objects[key] or self.objects[key][id]["is_deleted"]:
+                sync_status[command["uuid"]] = {"error_code": 22, "error": "Item not found"}
+                continue
+            elif action == "update":
+                self.objects[key][id].update({k: v for k, v in args.items() if k != "id"})
+                self.touch(key, id)
+            elif action == "close":
+                self.objects[key][id]["checked"] = True
+                self.touch(key, id)
+            elif action == "delete":
+                self.objects[key][id]["is_deleted"] = True
+                self.touch(key, id)
+            sync_status[command["uuid"]] = "ok"
+
+        full_sync = sync_token == "*"
+        since = 0 if full_sync else int(sync_token)
+        data: dict = {
+            "sync_token": str(self.version),
+            "full_sync": full_sync,
+            "temp_id_mapping": temp_id_mapping,
+            "sync_status": sync_status,
+        }
+        for key, objects in self.objects.items():
+            if "all" not in resource_types and key not in resource_types:
+                continue
+            data[key] = [
+                {k: v for k, v in obj.items() if k != "_version"}
+                for obj in objects.values()
+                if obj["_version"] > since and not (full_sync and (obj["is_deleted"] or obj.get("checked")))
+            ]
+        return 200, data
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_message(data: bytes) -> email.message.Message:
+    """Parse a message (once, the same messages are fetched several times)."""
+    return email.message_from_bytes(data)
+
+
+def get_bodystructure(part: email.message.Message) -> bytes:
+    """Return the BODYSTRUCTURE of a message (without the extension data)."""
+    if part.is_multipart():
+        subparts = b"".join(get_bodystructure(subpart) for subpart in part.get_payload())
+        return b"(" + subparts + f' "{part.get_content_subtype().upper()}")'.encode()
+    params = " ".join(f'"{name.upper()}" "{value}"' for name, value in part.get_params()[1:])
+    content = get_content(part)
+    fields = (
+        f'"{part.get_content_maintype().upper()}" "{part.get_content_subtype().upper()}" ({params or "NIL"}) NIL NIL'
+        f' "{part.get("Content-Transfer-Encoding", "7BIT").upper()}" {len(content)}'
+    )
+    if part.get_content_maintype() == "text":
+        fields += f" {len(content.splitlines())}"
+    return f"({fields})".encode()
+
+
+def get_content(part: email.message.Message) -> bytes:
+    """Return the encoded content of a single part."""
+    return part.get_payload().encode("ascii", "surrogateescape")
+
+
+def get_section(data: bytes, section: str) -> bytes:
+    """Return a section of a message ("HEADER" or a part number) without the attached messages."""
+    if section == "HEADER":
+        return data.partition(b"\n\n")[0] + b"\n\n"
+    part = parse_message(data)
+    for number in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+    return get_content(part)
+
+
+class FakeIMAP(socketserver.ThreadingTCPServer):
+    """A fake IMAP server that supports the commands used by the GMX reader."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailbox: dict[str, bytes]):
+        super().__init__(("127.0.0.1", 0), self.Handler)
+        self.mailbox: dict[str, bytes] = {}
+        self.uids: dict[str, int] = {}
+        self.changed = threading.Condition()
+        self.requests: dict[str, int] = defaultdict(int)
+        self.bytes_sent = 0
+        for id, data in mailbox.items():
+            self.add_message(id, data)
+
+    @property
+    def port(self):
+        """The port of the server."""
+        return self.server_address[1]
+
+    def start(self):
+        """Start serving in a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def add_message(self, id: str, data: bytes):
+        """Add a message to the inbox."""
+        with self.changed:
+            self.mailbox[id] = data
+            self.uids[id] = max(self.uids.values(), default=0) + 1
+            self.changed.notify_all()
+
+    def remove_message(self, id: str):
+        """Remove a message from the inbox."""
+        with self.changed:
+            del self.mailbox[id]
+            del self.uids[id]
+            self.changed.notify_all()
+
+    class Handler(socketserver.StreamRequestHandler):
+        """Handle an IMAP session."""
+
+        server: "FakeIMAP"
+        disable_nagle_algorithm = True
+
+        def send(self, data: bytes):
+            self.server.bytes_sent += len(data)
+            self.wfile.write(data)
+
+        def fetch(self, uid: int, items: str):
+            """Send the FETCH response for a message (RFC822, RFC822.SIZE, BODYSTRUCTURE and BODY.PEEK sections)."""
+            ids = list(self.server.uids)
+            id = next(id for id, message_uid in self.server.uids.items() if message_uid == uid)
+            data = self.server.mailbox[id]
+            response = f"* {ids.index(id) + 1} FETCH (UID {uid}".encode()
+            for item, section, origin, length in re.findall(
+                r"(BODY\.PEEK\[([^\]]*)\](?:<(\d+)\.(\d+)>)?|[\w.]+)", items
+            ):
+                if item == "RFC822":
+                    response += f" RFC822 {{{len(data)}}}\r\n".encode() + data
+                elif item == "RFC822.SIZE":
+                    response += f" RFC822.SIZE {len(data)}".encode()
+                elif item == "BODYSTRUCTURE":
+                    response += b" BODYSTRUCTURE " + get_bodystructure(parse_message(data))
+                elif section:
+                    content = get_section(data, section)
+                    name = f"BODY[{section}]"
+                    if origin:
+                        content = content[int(origin) : int(origin) + int(length)]
+                        name += f"<{origin}>"
+                    response += f" {name} {{{len(content)}}}\r\n".encode() + content
+            self.send(response + b")\r\n")
+
+        def idle(self, tag: str):
+            """Wait for a change in the inbox or for the end of the IDLE command."""
+            self.send(b"+ idling\r\n")
+            done = threading.Event()
+
+            def wait_done():
+                self.rfile.readline()
+                done.set()
+                with self.server.changed:
+                    self.server.changed.notify_all()
+
+            threading.Thread(target=wait_done, daemon=True).start()
+            count = len(self.server.mailbox)
+            with self.server.changed:
+                while not done.is_set():
+                    self.server.changed.wait()
+                    if not done.is_set() and len(self.server.mailbox) != count:
+                        self.send(f"* {len(self.server.mailbox)} EXISTS\r\n".encode())
+                        count = len(self.server.mailbox)
+            self.send(f"{tag} OK IDLE terminated\r\n".encode())
+
+        def handle(self):
+            self.send(b"* OK IMAP4rev1 fake server ready\r\n")
+            while line := self.rfile.readline():
+                tag, _, rest = line.decode().strip().partition(" ")
+                command, _, args = rest.partition(" ")
+                command = command.upper()
+                if command == "UID":
+                    command, _, args = args.partition(" ")
+                    command = f"UID {command.upper()}"
+                self.server.requests[command] += 1
+                uids = list(self.server.uids.values())
+                if command == "CAPABILITY":
+                    self.send(b"* CAPABILITY IMAP4rev1 IDLE\r\n")
+                elif command in ("SELECT", "EXAMINE"):
+                    self.send(f"* {len(uids)} EXISTS\r\n* 0 RECENT\r\n".encode())
+                    self.send(f"{tag} OK [READ-ONLY] {command} completed\r\n".encode())
+                    continue
+                elif command == "SEARCH":
+                    self.send(("* SEARCH " + " ".join(str(i + 1) for i in range(len(uids))) + "\r\n").encode())
+                elif command == "UID SEARCH":
+                    self.send(("* SEARCH " + " ".join(str(uid) for uid in uids) + "\r\n").encode())
+                elif command == "FETCH":
+                    num, _, items = args.partition(" ")
+                    self.fetch(uids[int(num) - 1], items)
+                elif command == "UID FETCH":
+                    uid, _, items = args.partition(" ")
+                    if int(uid) in uids:
+                        self.fetch(int(uid), items)
+                elif command == "IDLE":
+                    self.idle(tag)
+                    continue
+                elif command == "LOGOUT":
+                    self.send(b"* BYE logging out\r\n")
+                    self.send(f"{tag} OK LOGOUT completed\r\n".encode())
+                    return
+                self.send(f"{tag} OK {command} completed\r\n".encode())
+
+
+class FakeSMTP(socketserver.ThreadingTCPServer):
+    """A fake SMTP server (without TLS) that keeps the received messages."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), self.Handler)
+        self.lock = threading.Lock()
+        self.requests: dict[str, int] = defaultdict(int)
+        # The raw messages received
+        self.messages: list[bytes] = []
+        # The number of SMTP sessions
+        self.sessions = 0
+
+    @property
+    def port(self):
+        """The port of the server."""
+        return self.server_address[1]
+
+    def start(self):
+        """Start serving in a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    class Handler(socketserver.StreamRequestHandler):
+        """Handle an SMTP session."""
+
+        server: "FakeSMTP"
+        disable_nagle_algorithm = True
+
+        def send(self, line: str):
+            self.wfile.write(f"{line}\r\n".encode())
+
+        def handle(self):
+            with self.server.lock:
+                self.server.sessions += 1
+            self.send("220 fake.smtp ESMTP ready")
+            while line := self.rfile.readline():
+                command = line.decode().strip().split(" ")[0].upper()
+                with self.server.lock:
+                    self.server.requests[command] += 1
+                if command == "EHLO":
+                    self.send("250-fake.smtp")
+                    self.send("250 AUTH PLAIN LOGIN")
+                elif command == "AUTH":
+                    self.send("235 Authentication succeeded")
+                elif command == "DATA":
+                    self.send("354 End data with <CR><LF>.<CR><LF>")
+                    data = b""
+                    while (line := self.rfile.readline()) not in (b".\r\n", b""):
+                        data += line[1:] if line.startswith(b"..") else line
+                    with self.server.lock:
+                        self.server.messages.append(data)
+                    self.send("250 OK queued")
+                elif command == "QUIT":
+                    self.send("221 Bye")
+                    return
+                else:
+                    self.send("250 OK")
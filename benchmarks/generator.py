@@ -0,0 +1,99 @@
+"""Generate synthetic mailboxes and Todoist accounts for the benchmarks."""
+
+import datetime as dt
+import email.utils
+import random
+from email.message import EmailMessage
+
+WORDS = (
+    "lorem",
+    "ipsum",
+    "dolor",
+    "sit",
+    "amet",
+    "consectetur",
+    "adipiscing",
+    "elit",
+    "sed",
+    "do",
+    "eiusmod",
+    "tempor",
+    "incididunt",
+    "ut",
+    "labore",
+    "et",
+    "dolore",
+    "magna",
+    "aliqua",
+    "bonjour",
+    "merci",
+    "réunion",
+    "facture",
+    "rendez-vous",
+    "projet",
+    "semaine",
+    "prochaine",
+)
+
+
+def text(rng: random.Random, size: int) -> str:
+    """Return approximately `size` characters of random text."""
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+def make_message(index: int, platform: str, seed=0, body_size=2_000, attachment_size=0) -> bytes:
+    """Return the bytes of a synthetic email."""
+    rng = random.Random(f"{seed}-{platform}-{index}")
+    date = dt.datetime(2024, 1, 1, tzinfo=dt.UTC) + dt.timedelta(minutes=17 * index)
+
+    msg = EmailMessage()
+    sender = rng.choice(("alice@example.com", "bob@example.org", "noreply@shop.example", "news@example.net"))
+    msg["From"] = sender
+    msg["To"] = "me@example.com"
+    msg["Subject"] = f"Message {index}: {text(rng, 40)}"
+    msg["Date"] = email.utils.format_datetime(date)
+    msg["Message-ID"] = f"<{platform}-{seed}-{index}@example.com>"
+    msg["Received"] = f"from mx.example.com by mx.{platform}.example; {email.utils.format_datetime(date)}"
+    if sender.startswith("news"):
+        msg["List-ID"] = "<news.example.net>"
+
+    body = text(rng, body_size)
+    if index % 3 == 0:
+        # Some messages only have an HTML body
+        msg.set_content(f"<html><body><p>{body}</p></body></html>", subtype="html")
+    else:
+        msg.set_content(body)
+        if index % 2 == 0:
+            msg.add_alternative(f"<html><body><p>{body}</p></body></html>", subtype="html")
+
+    if attachment_size:
+        msg.add_attachment(
+            rng.randbytes(attachment_size), maintype="application", subtype="octet-stream", filename="file.bin"
+        )
+
+    return msg.as_bytes()
+
+
+def make_mailbox(count: int, platform: str, start=0, **kwargs) -> dict[str, bytes]:
+    """Return a mailbox (message ID to bytes) with `count` synthetic messages."""
+    return {f"{platform}{i:08x}": make_message(i, platform, **kwargs) for i in range(start, start + count)}
+
+
+def make_tasks(count: int, seed=0) -> list[dict]:
+    """Return `count` Todoist items that are not related to the automation."""
+    rng = random.Random(f"{seed}-tasks")
+    return [
+        {
+            "content": text(rng, 30),
+            "description": text(rng, rng.randrange(0, 300)),
+            "due": None if i % 4 else {"date": f"2024-02-{i % 28 + 1:02}T09:00:00"},
+            "priority": rng.randrange(1, 5),
+        }
+        for i in range(count)
+    ]
@@ -0,0 +1,132 @@
+"""Compare the peak RSS of loading a large Todoist replica as raw JSON data and as compact records.
+
+Usage: python -m benchmarks.memory [--items 50000]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.driver import peak_rss
+from benchmarks.fakes import FakeTodoist
+from benchmarks.generator import make_tasks
+from benchmarks.run import copy_code
+
+
+def load_raw(code_dir: Path):
+    """Load the replica like the old code did: keep the raw JSON objects and create a `Task` per item."""
+    from todoist import Comment, SyncStatus, Task  # pylint: disable=C0415
+
+    data = json.loads((code_dir / "cache/raw.json").read_text("utf-8"))
+    status = SyncStatus.__new__(SyncStatus)
+    tasks = [
+        Task(status=status, _id=item["id"], title=item["content"], description=item["description"])
+        for item in data["items"]
+    ]
+    comments = [
+        Comment(status=status, _id=note["id"], task=tasks[0], content=note["content"]) for note in data["notes"]
+    ]
+    return data, tasks, comments
+
+
+def load_compact(code_dir: Path):
+    """Load the replica with `SyncStatus` (compact records) and create a `Task` per item."""
+    from todoist import SyncStatus, Task  # pylint: disable=C0415
+
+    status = SyncStatus(["items", "notes"], max_age=float("inf"))
+    return status, Task.all(status)
+
+
+def measure(mode: str, code_dir: Path):
+    """Load the replica in the current process and print the measurements as JSON."""
+    sys.path.insert(0, str(code_dir))
+    before = peak_rss()
+    start = time.perf_counter()
+    loaded = (load_raw if mode == "raw" else load_compact)(code_dir)
+    duration = time.perf_counter() - start
+    print(
+        json.dumps({
+            "mode": mode,
+            "duration": duration,
+            "peak_rss": peak_rss(),
+            "baseline_rss": before,
+        })
+    )
+    del loaded
+
+
+def prepare(code_dir: Path, items: int):
+    """Write the raw replica and the compact replica of a synthetic account."""
+    todoist = FakeTodoist(make_tasks(items))
+    todoist.server_close()
+    data: dict = {"sync_token": "1", "resource_types": ["items", "notes"], "synced_at": time.time()}
+    for key, objects in todoist.objects.items():
+        data[key] = [{k: v for k, v in obj.items() if k != "_version"} for obj in objects.values()]
+
+    (code_dir / "cache").mkdir()
+    (code_dir / "cache/raw.json").write_text(json.dumps(data), "utf-8")
+
+    # Convert the raw replica to the compact format in a subprocess (to keep this process small)
+    script = (
+        "import sys, json; sys.path.insert(0, sys.argv[1]);"
+        "from todoist import SyncStatus;"
+        "from cache_store import ContentStore;"
+        "status = SyncStatus.__new__(SyncStatus);"
+        "from pathlib import Path;"
+        "status.file = Path(sys.argv[1]) / 'cache/todoist_status.json';"
+        "status.store = ContentStore('todoist');"
+        "status.raw_file = status.file.with_name('todoist_raw.sqlite3');"
+        "data = json.loads((Path(sys.argv[1]) / 'cache/raw.json').read_text('utf-8'));"
+        "status._save_raw(data);"
+        "status.data = SyncStatus._load_records(data);"
+        "status._save()"
+    )
+    subprocess.run([sys.executable, "-c", script, str(code_dir)], check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=50_000, help="number of Todoist items")
+    parser.add_argument("--measure", choices=("raw", "compact"), help=argparse.SUPPRESS)
+    parser.add_argument("--code-dir", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.code_dir)
+        return
+
+    code_dir = Path(tempfile.mkdtemp(prefix="automation-memory-"))
+    try:
+        copy_code(code_dir)
+        prepare(code_dir, args.items)
+        print(f"{args.items} items")
+        print(f"{'mode':<10} {'load (s)':>9} {'peak RSS (MB)':>14} {'file (MB)':>10}")
+        chunks = (code_dir / "cache/store/todoist").iterdir()
+        compact_files = ["todoist_status.json", *(f"store/todoist/{chunk.name}" for chunk in chunks)]
+        for mode, files in (("raw", ["raw.json"]), ("compact", compact_files)):
+            proc = subprocess.run(
+                [sys.executable, "-m", "benchmarks.memory", "--measure", mode, "--code-dir", str(code_dir)],
+                cwd=Path(__file__).parent.parent,
+                env=os.environ,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            result = json.loads(proc.stdout.splitlines()[-1])
+            size = sum((code_dir / "cache" / file).stat().st_size for file in files)
+            print(
+                f"{mode:<10} {result['duration']:>9.3f} {result['peak_rss'] / 1_048_576:>14.1f}"
+                f" {size / 1_048_576:>10.1f}"
+            )
+    finally:
+        shutil.rmtree(code_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
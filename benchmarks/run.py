@@ -0,0 +1,153 @@
+"""Run the end-to-end benchmarks against local fakes for Gmail, IMAP and Todoist.
+
+Usage: python -m benchmarks.run [--gmail 200] [--gmx 200] [--tasks 1000] [--delta 100] [--latency 0] [--json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.fakes import FakeGoogle, FakeIMAP, FakeSMTP, FakeTodoist
+from benchmarks.generator import make_mailbox, make_tasks
+
+ROOT = Path(__file__).parent.parent
+
+
+def copy_code(target: Path):
+    """Copy the code of the project into `target` so that it uses its own `cache/` directory."""
+    for file in ROOT.glob("*.py"):
+        shutil.copy(file, target / file.name)
+
+
+class Benchmark:
+    """A set of fake servers and a copy of the code that can be run in several scenarios."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        kwargs = {"seed": args.seed, "body_size": args.body_size, "attachment_size": args.attachment_size}
+        self.kwargs = kwargs
+        latency = args.latency / 1000
+        self.google = FakeGoogle(make_mailbox(args.gmail, "gmail", **kwargs), latency).start()
+        self.imap = FakeIMAP(make_mailbox(args.gmx, "gmx", **kwargs)).start()
+        self.smtp = FakeSMTP().start()
+        self.todoist = FakeTodoist(make_tasks(args.tasks, seed=args.seed), latency).start()
+        self.code_dir = Path(tempfile.mkdtemp(prefix="automation-benchmark-"))
+        copy_code(self.code_dir)
+
+    def servers(self):
+        return {"gmail": self.google, "imap": self.imap, "todoist": self.todoist}
+
+    def run(self, name: str) -> dict:
+        """Run `main.py` once and return the measurements."""
+        before = {key: sum(server.requests.values()) for key, server in self.servers().items()}
+        env = {
+            **os.environ,
+            "BENCHMARK_CONFIG": json.dumps({
+                "code_dir": str(self.code_dir),
+                "hosts": {
+                    "gmail.googleapis.com": self.google.url,
+                    "oauth2.googleapis.com": self.google.url,
+                    "api.todoist.com": self.todoist.url,
+                },
+                "imap_port": self.imap.port,
+                "smtp_port": self.smtp.port,
+            }),
+            "GMX_USER": "me@example.com",
+            "GMX_PASSWORD": "password",
+            "GOOGLE_TOKEN": "fake-google-token",
+            "GOOGLE_REFRESH_TOKEN": "fake-refresh-token",
+            "GOOGLE_CLIENT_ID": "fake-client-id",
+            "GOOGLE_CLIENT_SECRET": "fake-client-secret",
+            "TODOIST_CLIENT_ID": "fake-client-id",
+            "TODOIST_CLIENT_SECRET": "fake-client-secret",
+            "TODOIST_TOKEN": "fake-todoist-token",
+        }
+        proc = subprocess.run(
+            [sys.executable, str(Path(__file__).parent / "driver.py")],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if proc.returncode:
+            raise RuntimeError(f"Scenario {name} failed:\n{proc.stderr}")
+        result = json.loads(proc.stdout.splitlines()[-1])
+
+        counters = result["stats"]["counters"]
+        for key, mailbox in (("gmail", self.google.mailbox), ("gmx", self.imap.mailbox)):
+            if counters.get(f"{key}.messages", 0) != len(mailbox):
+                raise RuntimeError(f"Scenario {name}: {key} returned {counters.get(f'{key}.messages', 0)} messages")
+
+        result["name"] = name
+        result["requests"] = {
+            key: sum(server.requests.values()) - before[key] for key, server in self.servers().items()
+        }
+        return result
+
+    def add_delta(self):
+        """Add new messages and remove old ones in both mailboxes."""
+        delta = self.args.delta
+        for key, server, count in (("gmail", self.google, self.args.gmail), ("gmx", self.imap, self.args.gmx)):
+            for id in list(server.mailbox)[: delta // 2]:
+                server.remove_message(id)
+            for id, data in make_mailbox(delta, key, start=count, **self.kwargs).items():
+                server.add_message(id, data)
+
+    def close(self):
+        for server in self.servers().values():
+            server.shutdown()
+        shutil.rmtree(self.code_dir, ignore_errors=True)
+
+
+def print_results(results: list[dict]):
+    """Print a table with the results of the scenarios."""
+    print(
+        f"{'scenario':<12} {'wall (s)':>9} {'gmail req':>10} {'imap cmd':>9} {'todoist req':>12} {'peak RSS (MB)':>14}"
+    )
+    for result in results:
+        requests = result["requests"]
+        print(
+            f"{result['name']:<12} {result['wall_time']:>9.3f} {requests['gmail']:>10} {requests['imap']:>9}"
+            f" {requests['todoist']:>12} {result['peak_rss'] / 1_048_576:>14.1f}"
+        )
+    for result in results:
+        print()
+        print(f"{result['name']} stages:")
+        for name, timer in result["stats"]["timers"].items():
+            print(f"    {name}: {timer['duration']:.3f} s ({timer['calls']} calls)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gmail", type=int, default=200, help="number of Gmail messages")
+    parser.add_argument("--gmx", type=int, default=200, help="number of GMX messages")
+    parser.add_argument("--tasks", type=int, default=1000, help="number of unrelated Todoist tasks")
+    parser.add_argument("--delta", type=int, default=100, help="number of new messages in the large delta scenario")
+    parser.add_argument("--body-size", type=int, default=2_000, help="size of the message bodies")
+    parser.add_argument("--attachment-size", type=int, default=0, help="size of the message attachments")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--latency", type=float, default=0, help="latency of the fake HTTP servers in milliseconds")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args)
+    try:
+        results = [benchmark.run("cold"), benchmark.run("warm")]
+        benchmark.add_delta()
+        results.append(benchmark.run("delta"))
+    finally:
+        benchmark.close()
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
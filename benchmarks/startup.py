@@ -0,0 +1,84 @@
+"""Measure the import time of `main.py` with `python -X importtime` to guard the cold start of the cron runs.
+
+Usage: python -m benchmarks.startup [--runs 10] [--max-ms 80]
+
+The script fails if a module that should only be imported when it is needed (SMTP, IMAP, HTML parser, TLS...)
+is imported at startup, or if the median import time is above `--max-ms` when it is given (the import time depends
+on the machine, so it is only compared locally and not in the CI).
+"""
+
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# Modules that must not be imported by `import main`
+LAZY_MODULES = (
+    "asyncio",
+    "email.policy",
+    "html.parser",
+    "http.client",
+    "imaplib",
+    "select",
+    "smtplib",
+    "ssl",
+    "traceback",
+    "urllib.request",
+    "zoneinfo",
+)
+
+
+def import_time(module: str) -> tuple[int, set[str]]:
+    """Return the cumulative import time of `module` (in microseconds) and the set of imported modules."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    modules = set()
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if not match:
+            continue
+        modules.add(match[4])
+        if match[4] == module and len(match[3]) == 1:
+            total = int(match[2])
+    return total, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="number of runs")
+    parser.add_argument("--max-ms", type=float, help="maximum median import time in milliseconds (optional)")
+    parser.add_argument("--module", default="main", help="module to import")
+    args = parser.parse_args()
+
+    times = []
+    modules: set[str] = set()
+    for _ in range(args.runs):
+        total, modules = import_time(args.module)
+        times.append(total / 1000)
+
+    median = statistics.median(times)
+    print(f"import {args.module}: median {median:.1f} ms, min {min(times):.1f} ms, max {max(times):.1f} ms")
+
+    errors = []
+    eager = sorted(module for module in LAZY_MODULES if module in modules)
+    if eager:
+        errors.append(f"modules imported at startup: {', '.join(eager)}")
+    if args.max_ms is not None and median > args.max_ms:
+        errors.append(f"median import time above {args.max_ms} ms")
+    for error in errors:
+        print(f"Error: {error}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
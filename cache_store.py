@@ -0,0 +1,108 @@
+"""
+A content-addressed store for the cached data that changes slowly, kept apart from the small state that changes on
+every run (sync tokens, OAuth tokens, stats...).
+
+The chunks of the store are named after the hash of their content and never modified, so the CI cache of the content
+(`cache/store/` and the SQLite databases) only changes when the data changes.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Iterable
+
+CACHE_DIR = Path(__file__).parent / "cache"
+STORE_DIR = CACHE_DIR / "store"
+# The content files (relative to `CACHE_DIR`) and their digest when `snapshot` was called
+SNAPSHOT_FILE = CACHE_DIR / "store_snapshot.json"
+# The content files that are not in the store (they are only written when the data changes)
+CONTENT_PATTERNS = ("**/*.sqlite3",)
+
+
+class ContentStore:
+    """The chunks of one user of the store (e.g. "todoist"), by key."""
+
+    def __init__(self, namespace: str):
+        self.dir = STORE_DIR / namespace
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()[:32]
+
+    def put(self, data: bytes) -> str:
+        """Add a chunk to the store (if it isn't already there) and return its key."""
+        key = self.key(data)
+        file = self.dir / key
+        if not file.exists():
+            self.dir.mkdir(parents=True, exist_ok=True)
+            new_file = file.with_name(f"{key}.new")
+            new_file.write_bytes(data)
+            new_file.replace(file)
+        return key
+
+    def get(self, key: str) -> bytes:
+        """Return the content of a chunk (raise `FileNotFoundError` if it isn't in the store)."""
+        return (self.dir / key).read_bytes()
+
+    def gc(self, keep: Iterable[str]) -> list[str]:
+        """Remove the chunks that are not in `keep` and return their keys."""
+        keep = set(keep)
+        removed = []
+        if self.dir.exists():
+            for file in self.dir.iterdir():
+                if file.name not in keep:
+                    file.unlink()
+                    removed.append(file.name)
+        return removed
+
+
+def get_content_files() -> dict[str, str]:
+    """Return the digest of each content file (the path relative to the cache directory)."""
+    files = {}
+    if STORE_DIR.exists():
+        for file in STORE_DIR.glob("*/*"):
+            # The name of a chunk is already its digest
+            files[file.relative_to(CACHE_DIR).as_posix()] = file.name
+    for pattern in CONTENT_PATTERNS:
+        for file in CACHE_DIR.glob(pattern):
+            files[file.relative_to(CACHE_DIR).as_posix()] = ContentStore.key(file.read_bytes())
+    return dict(sorted(files.items()))
+
+
+def snapshot():
+    """Save the digests of the content files, to find the changes later with `changes`."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    SNAPSHOT_FILE.write_text(json.dumps(get_content_files(), indent=2), "utf-8")
+
+
+def changes() -> dict[str, list[str]]:
+    """Return the content files that have been added, modified or removed since the last snapshot."""
+    before = json.loads(SNAPSHOT_FILE.read_text("utf-8")) if SNAPSHOT_FILE.exists() else {}
+    after = get_content_files()
+    return {
+        "added": [path for path in after if path not in before],
+        "modified": [path for path in after if path in before and after[path] != before[path]],
+        "removed": [path for path in before if path not in after],
+    }
+
+
+def report():
+    """Print the content files and the changes since the last snapshot."""
+    files = get_content_files()
+    changed = changes()
+    status = {path: kind for kind, paths in changed.items() for path in paths}
+    total = 0
+    for path in files:
+        size = (CACHE_DIR / path).stat().st_size
+        total += size
+        print(f"{status.get(path, 'unchanged'):<10} {size:>12,} {path}")
+    for path in changed["removed"]:
+        print(f"{'removed':<10} {'':>12} {path}")
+    print(f"{len(files)} content files, {total:,} bytes")
+    print(", ".join(f"{len(paths)} {kind}" for kind, paths in changed.items()))
+
+    # Tell the GitHub workflow whether the content has to be saved
+    if output := os.environ.get("GITHUB_OUTPUT"):
+        with open(output, "a", encoding="utf-8") as f:
+            f.write(f"changed={str(any(changed.values())).lower()}\n")
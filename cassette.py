@@ -0,0 +1,159 @@
+"""
+Record the responses of the HTTP and IMAP servers during a run, and replay them later to run the whole pipeline
+without touching the real accounts (e.g. to measure its performance on real-shaped data).
+
+When a cassette is active, the local caches (messages, Todoist replica) are not read, so that the recorded run and
+the replayed runs do the same requests. When replaying, nothing is written to the caches and the Todoist commands are
+printed instead of being sent.
+"""
+
+import base64
+import json
+import re
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+DEFAULT_FILE = Path(__file__).parent / "cache/cassette.json.gz"
+# The query and form parameters that contain credentials (their values are removed from the keys of the requests)
+SECRET_PARAMS_RE = re.compile(rb"\b(access_token|refresh_token|client_secret)=[^&]*")
+# The endpoints whose responses contain credentials: they are not recorded (the tokens are not validated in a replay)
+SECRET_URLS = ("https://oauth2.googleapis.com/", "https://api.todoist.com/api/v1/user")
+
+
+class CassetteMiss(OSError):
+    """The cassette doesn't contain a response for a request."""
+
+
+def encode(value) -> Any:
+    """Convert bytes and tuples (in the IMAP responses) to JSON-serializable data."""
+    if isinstance(value, bytes):
+        return {"bytes": base64.b64encode(value).decode()}
+    if isinstance(value, tuple):
+        return {"tuple": [encode(item) for item in value]}
+    if isinstance(value, list):
+        return [encode(item) for item in value]
+    return value
+
+
+def decode(value) -> Any:
+    """Convert the data returned by `encode` back to bytes and tuples."""
+    if isinstance(value, dict) and "bytes" in value:
+        return base64.b64decode(value["bytes"])
+    if isinstance(value, dict) and "tuple" in value:
+        return tuple(decode(item) for item in value["tuple"])
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+class Cassette:
+    """The recorded responses, by request (in the order they were received for identical requests)."""
+
+    def __init__(self):
+        # "record", "replay" or None
+        self.mode: str | None = None
+        self.file = DEFAULT_FILE
+        self.lock = threading.Lock()
+        self.responses: dict[str, list[Any]] = defaultdict(list)
+
+    @property
+    def active(self):
+        return self.mode is not None
+
+    @property
+    def recording(self):
+        return self.mode == "record"
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def start(self, mode: str, file: Path = DEFAULT_FILE):
+        """Start recording the responses to a file or replaying the responses of a file."""
+        import gzip  # pylint: disable=C0415
+
+        self.mode = mode
+        self.file = file
+        self.responses.clear()
+        if mode == "replay":
+            with gzip.open(file, "rt", encoding="utf-8") as f:
+                self.responses.update(json.load(f))
+            print(f"Replaying {sum(map(len, self.responses.values()))} responses from {file}")
+
+    def stop(self):
+        """Save the recorded responses (if recording) and stop using the cassette."""
+        import gzip  # pylint: disable=C0415
+
+        if self.recording:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            new_file = self.file.with_name(self.file.name + ".new")
+            with gzip.open(new_file, "wt", encoding="utf-8") as f, self.lock:
+                json.dump(self.responses, f)
+            new_file.replace(self.file)
+            print(f"Recorded {sum(map(len, self.responses.values()))} responses to {self.file}")
+        self.mode = None
+
+    @staticmethod
+    def key(*parts) -> str:
+        return " ".join(str(part) for part in parts)
+
+    def record(self, key: str, response: Any):
+        """Record the response to a request."""
+        if self.recording:
+            with self.lock:
+                self.responses[key].append(encode(response))
+
+    def replay(self, key: str) -> Any:
+        """Return the next recorded response to a request (the last one is repeated)."""
+        with self.lock:
+            responses = self.responses.get(key)
+            if not responses:
+                raise CassetteMiss(f"No recorded response for {key}")
+            return decode(responses.pop(0) if len(responses) > 1 else responses[0])
+
+    @staticmethod
+    def http_key(method: str, url: str, body: bytes | None) -> str:
+        """Return the key of an HTTP request, without the credentials (the body is hashed to keep the keys short)."""
+        import hashlib  # pylint: disable=C0415
+
+        url = SECRET_PARAMS_RE.sub(rb"\1=", url.encode()).decode()
+        body = SECRET_PARAMS_RE.sub(rb"\1=", body or b"")
+        return Cassette.key("HTTP", method, url, hashlib.sha256(body).hexdigest()[:16])
+
+    @staticmethod
+    def is_secret(url: str) -> bool:
+        """Return True if the responses of a URL contain credentials (and must not be recorded)."""
+        return url.startswith(SECRET_URLS)
+
+
+cassette = Cassette()
+
+
+class CassetteIMAP:
+    """
+    An IMAP connection that records the responses of a real connection, or replays them (if `conn` is None).
+
+    Only the commands used by `check_gmx_emails` (UID commands) are supported.
+    """
+
+    def __init__(self, conn, platform: str):
+        self.conn = conn
+        self.platform = platform
+
+    def uid(self, command: str, *args):
+        key = Cassette.key("IMAP", self.platform, command, *args)
+        if self.conn is None:
+            return cassette.replay(key)
+        response = self.conn.uid(command, *args)
+        cassette.record(key, response)
+        return response
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+    def logout(self):
+        if self.conn is not None:
+            self.conn.logout()
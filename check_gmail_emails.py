@@ -1,41 +1,155 @@
 """Functions to get emails from Gmail."""
 
 import base64
-from pathlib import Path
+from typing import Iterable
 
 import custom_requests
+from accounts import Account
 from email_utils import Message
+from message_cache import MessageCache
 from oauth_token import Token
+from stats import stats
 
+API_URL = "https://gmail.googleapis.com/gmail/v1/users/me"
+DEFAULT_ACCOUNT = Account("gmail")
+# The maximum number of messages downloaded at the same time
+MAX_CONCURRENT_DOWNLOADS = 10
+# The maximum page size of the list endpoints (the default is 100)
+MAX_PAGE_SIZE = 500
 
-def get_content(message_id: str) -> bytes:
+
+def get_token(account: Account) -> Token:
+    """Return the Google token of an account."""
+    return Token.for_provider("google", account.name)
+
+
+def get_content(message_id: str, account: Account = DEFAULT_ACCOUNT) -> bytes:
     """Get the content of a message from the ID given by the Gmail API."""
-    file = Path(__file__).parent / f"cache/message_{message_id}"
-    if file.exists():
-        return file.read_bytes()
-    data = custom_requests.get(
-        f"https://gmail.googleapis.com/gmail/v1/users/me/messages/{message_id}?format=raw",
-        token=Token.for_provider("google"),
-    ).json()
+    cache = MessageCache(account)
+    ret = cache.get(message_id)
+    stats.hit("gmail.cache", ret is not None)
+    if ret is not None:
+        return ret
+    with stats.timer("gmail.fetch"):
+        data = custom_requests.get(
+            f"{API_URL}/messages/{message_id}?format=raw",
+            token=get_token(account),
+        ).json()
     ret = base64.urlsafe_b64decode(data["raw"])
-    file.parent.mkdir(parents=True, exist_ok=True)
-    file.write_bytes(ret)
+    cache.put_many({message_id: ret})
     return ret
 
 
-def get_gmail_emails():
+def download_contents(message_ids: list[str], account: Account = DEFAULT_ACCOUNT) -> dict[str, bytes]:
+    """Download the content of some messages concurrently, cache it and return it by message ID."""
+    import asyncio  # pylint: disable=C0415
+
+    token = get_token(account)
+
+    async def download_all():
+        async with custom_requests.AsyncClient(limit_per_host=MAX_CONCURRENT_DOWNLOADS) as client:
+
+            async def download(message_id: str):
+                response = await client.get(f"{API_URL}/messages/{message_id}?format=raw", token=token)
+                return message_id, base64.urlsafe_b64decode(response.json()["raw"])
+
+            return dict(await asyncio.gather(*(download(message_id) for message_id in message_ids)))
+
+    with stats.timer("gmail.fetch"):
+        contents = asyncio.run(download_all())
+    for message_id in contents:
+        stats.hit("gmail.cache", False)
+    MessageCache(account).put_many(contents)
+    return contents
+
+
+def get_gmail_message(message_id: str, account: Account = DEFAULT_ACCOUNT, content: bytes | None = None) -> Message:
+    """Return a message from the ID given by the Gmail API (and its content if it has already been downloaded)."""
+    stats.count("gmail.messages")
+    if content is None:
+        content = get_content(message_id, account)
+    return Message.from_bytes(content, account.platform)
+
+
+def get_gmail_messages(message_ids: Iterable[str], account: Account = DEFAULT_ACCOUNT) -> list[Message]:
+    """Return the messages with the given IDs, downloading the ones that are not cached concurrently."""
+    message_ids = list(message_ids)
+    contents = MessageCache(account).get_many(message_ids)
+    for message_id in contents:
+        stats.hit("gmail.cache", True)
+    to_download = [message_id for message_id in message_ids if message_id not in contents]
+    if to_download:
+        contents.update(download_contents(to_download, account))
+    return [get_gmail_message(message_id, account, contents.pop(message_id, None)) for message_id in message_ids]
+
+
+def prune_cache(message_ids: Iterable[str], account: Account = DEFAULT_ACCOUNT):
+    """Remove the messages that are no longer in the inbox (not in `message_ids`) from the cache."""
+    cache = MessageCache(account)
+    with stats.timer("gmail.cache_prune"):
+        cache.prune(message_ids)
+    cache.report()
+
+
+def get_gmail_message_ids(account: Account = DEFAULT_ACCOUNT) -> Iterable[str]:
+    """Yield the IDs of all the messages in the Gmail inbox."""
+    with stats.timer("gmail.token"):
+        token = get_token(account)
+    for message in custom_requests.get_with_pages(
+        f"{API_URL}/messages",
+        {
+            "includeSpamTrash": "false",
+            "labelIds": "INBOX",
+        },
+        token=token,
+        page_size=MAX_PAGE_SIZE,
+        prefetch=1,
+    ):
+        yield message["id"]
+
+
+def get_gmail_emails(account: Account = DEFAULT_ACCOUNT):
     """Return all the emails in the Gmail inbox."""
-    message_ids = (
-        message["id"]
-        for message in custom_requests.get_with_pages(
-            "https://gmail.googleapis.com/gmail/v1/users/me/messages",
-            {
-                "includeSpamTrash": "false",
-                "labelIds": "INBOX",
-            },
-            token=Token.for_provider("google"),
-        )
-    )
-
-    for message_id in message_ids:
-        yield Message.from_bytes(get_content(message_id), "gmail")
+    message_ids = list(get_gmail_message_ids(account))
+    messages = get_gmail_messages(message_ids, account)
+    prune_cache(message_ids, account)
+    return messages
+
+
+def get_history_id(account: Account = DEFAULT_ACCOUNT) -> str:
+    """Return the current history ID of the mailbox (to get the changes that happen after this point)."""
+    return custom_requests.get(f"{API_URL}/profile", token=get_token(account)).json()["historyId"]
+
+
+def get_gmail_changes(history_id: str, account: Account = DEFAULT_ACCOUNT) -> tuple[set[str], set[str], str]:
+    """
+    Return the IDs of the messages that were added to and removed from the inbox since `history_id`,
+    and the history ID to use for the next call.
+
+    If the history ID is too old, the Gmail API returns a 404 error and a full sync is needed.
+    """
+    added: set[str] = set()
+    removed: set[str] = set()
+    with stats.timer("gmail.history"):
+        for record in custom_requests.get_with_pages(
+            f"{API_URL}/history",
+            {"startHistoryId": history_id, "labelId": "INBOX"},
+            token=get_token(account),
+            page_size=MAX_PAGE_SIZE,
+        ):
+            history_id = max(history_id, record["id"], key=int)
+            changes = [
+                *((True, change) for change in record.get("messagesAdded", [])),
+                *((True, change) for change in record.get("labelsAdded", []) if "INBOX" in change["labelIds"]),
+                *((False, change) for change in record.get("labelsRemoved", []) if "INBOX" in change["labelIds"]),
+                *((False, change) for change in record.get("messagesDeleted", [])),
+            ]
+            for is_added, change in changes:
+                message_id = change["message"]["id"]
+                if is_added:
+                    added.add(message_id)
+                    removed.discard(message_id)
+                else:
+                    removed.add(message_id)
+                    added.discard(message_id)
+    return added, removed, history_id
@@ -1,24 +1,207 @@
 """Functions to get emails from GMX."""
 
-import imaplib
-from typing import Iterable
+import itertools
+import re
+import typing
+from typing import Any, Iterable, Iterator
 
+from accounts import Account
+from cassette import CassetteIMAP, cassette
 from email_utils import Message
-from get_secrets import secrets
+from stats import stats
 
+if typing.TYPE_CHECKING:
+    import imaplib
 
-def get_gmx_emails() -> Iterable[Message]:
+# The IDLE command must be restarted before the server closes the connection (RFC 2177 recommends 29 minutes)
+IDLE_TIMEOUT = 5 * 60
+DEFAULT_ACCOUNT = Account("gmx")
+# The number of bytes fetched from the text part of a message: enough for the 16 KB limit of the task descriptions,
+# even for encoded (base64, quoted-printable) or HTML text
+MAX_TEXT_SIZE = 64 * 1024
+# A token of an IMAP response: a parenthesis, a quoted string, a literal or an atom
+TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:\\.|[^"\\])*)"|\{(\d+)\}\r\n|([^\s()"]+))')
+
+
+def connect(account: Account = DEFAULT_ACCOUNT) -> "imaplib.IMAP4":
+    """Open a read-only connection to the GMX inbox of an account."""
+    import imaplib  # pylint: disable=C0415
+
+    if cassette.replaying:
+        return CassetteIMAP(None, account.platform)  # type: ignore
+    with stats.timer("gmx.connect"):
+        conn = imaplib.IMAP4_SSL("imap.gmx.com")
+    with stats.timer("gmx.login"):
+        conn.login(account.secret("USER"), account.secret("PASSWORD"))
+        conn.select(readonly=True)
+    if cassette.recording:
+        return CassetteIMAP(conn, account.platform)  # type: ignore
+    return conn
+
+
+def disconnect(conn: "imaplib.IMAP4"):
+    """Close a connection opened with `connect`."""
+    conn.close()
+    conn.logout()
+
+
+def get_uids(conn: "imaplib.IMAP4") -> list[str]:
+    """Return the UIDs of all the messages in the inbox."""
+    with stats.timer("gmx.search"):
+        _, data = conn.uid("SEARCH", None, "(ALL)")  # type: ignore
+    return data[0].decode().split()
+
+
+def parse_list(data: bytes) -> list:
+    """Parse an IMAP response into nested lists of bytes (None for NIL)."""
+    stack: list[list] = [[]]
+    pos = 0
+    while match := TOKEN_RE.match(data, pos):
+        pos = match.end()
+        opening, closing, quoted, literal, atom = match.groups()
+        if opening:
+            stack.append([])
+        elif closing and len(stack) > 1:
+            items = stack.pop()
+            stack[-1].append(items)
+        elif quoted is not None:
+            stack[-1].append(re.sub(rb"\\(.)", rb"\1", quoted))
+        elif literal:
+            stack[-1].append(data[pos : pos + int(literal)])
+            pos += int(literal)
+        elif atom:
+            stack[-1].append(None if atom.upper() == b"NIL" else atom)
+    return stack[0]
+
+
+def parse_fetch(data: list) -> dict[bytes, Any]:
+    """Return the data items of the response to a FETCH command by name (e.g. `b"BODYSTRUCTURE"`)."""
+    # The literals are returned by imaplib as (line ending with "{size}", literal) tuples
+    response = b"".join(item[0] + b"\r\n" + item[1] if isinstance(item, tuple) else item for item in data if item)
+    items: dict[bytes, Any] = {}
+    for values in parse_list(response):
+        if isinstance(values, list):
+            for name, value in zip(values[::2], values[1::2]):
+                items.setdefault(name.upper(), value)
+    return items
+
+
+def walk_parts(part: list, section: str = "", is_body: bool = True) -> Iterator[tuple[str, list]]:
+    """
+    Yield the section and the structure of each single part of a BODYSTRUCTURE, in the order of `Message.walk`.
+
+    `section` is the section of `part`, "" for the message, and `is_body` is True if `part` is the body of a message.
+    """
+    if isinstance(part[0], list):
+        # The subparts of a multipart are followed by its subtype and extension data
+        subparts = itertools.takewhile(lambda subpart: isinstance(subpart, list), part)
+        for i, subpart in enumerate(subparts, 1):
+            yield from walk_parts(subpart, f"{section}.{i}".lstrip("."), False)
+        return
+    if is_body:
+        # The body of a message that is not a multipart is its part 1
+        section = f"{section}.1".lstrip(".")
+    yield section, part
+    is_message = (part[0] or b"").upper() == b"MESSAGE" and (part[1] or b"").upper() == b"RFC822"
+    if is_message and len(part) > 8 and isinstance(part[8], list):
+        yield from walk_parts(part[8], section)
+
+
+def find_text_part(structure: list) -> tuple[str, list] | None:
+    """Return the section and the structure of the part used by `get_body` (the first plain text or HTML part)."""
+    parts = list(walk_parts(structure))
+    for subtype in (b"PLAIN", b"HTML"):
+        for section, part in parts:
+            # A part without a content type is plain text, like in `get_part_header`
+            if (part[0] or b"TEXT").upper() == b"TEXT" and (part[1] or b"PLAIN").upper() == subtype:
+                return section, part
+    return None
+
+
+def get_part_header(part: list) -> bytes:
+    """Return the MIME header of a part from its structure."""
+    # The default content type is text/plain (RFC 2045)
+    content_type = (part[0] or b"text").lower() + b"/" + (part[1] or b"plain").lower()
+    params = part[2] or []
+    for name, value in zip(params[::2], params[1::2]):
+        content_type += b"; " + name.lower() + b'="' + value.replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"'
+    return b"Content-Type: " + content_type + b"\r\nContent-Transfer-Encoding: " + (part[5] or b"7bit") + b"\r\n\r\n"
+
+
+def get_message(conn: "imaplib.IMAP4", uid: str, account: Account = DEFAULT_ACCOUNT) -> Message:
+    """
+    Return the message with the given UID.
+
+    Only the header and the beginning of the text part used for the body are fetched, not the other parts (e.g. the
+    attachments).
+    """
+    with stats.timer("gmx.fetch"):
+        typ, data = conn.uid("FETCH", uid, "(RFC822.SIZE BODYSTRUCTURE)")
+        items = parse_fetch(data) if typ == "OK" else {}
+        if not items.get(b"BODYSTRUCTURE"):
+            raise RuntimeError(f"Error getting message {uid}")
+        size = int(items.get(b"RFC822.SIZE") or 0)
+        text_part = find_text_part(items[b"BODYSTRUCTURE"])
+        sections = "BODY.PEEK[HEADER]"
+        if text_part:
+            sections += f" BODY.PEEK[{text_part[0]}]<0.{MAX_TEXT_SIZE}>"
+        typ, data = conn.uid("FETCH", uid, f"({sections})")
+        items = parse_fetch(data) if typ == "OK" else {}
+    header = items.get(b"BODY[HEADER]")
+    if not header:
+        raise RuntimeError(f"Error getting message {uid}")
+    text = None
+    if text_part:
+        # The server adds the origin of the partial range to the name (e.g. "BODY[1]<0>")
+        prefix = f"BODY[{text_part[0]}]".encode()
+        text = next((value or b"" for name, value in items.items() if name.startswith(prefix)), b"")
+        if len(text) == MAX_TEXT_SIZE:
+            # Remove the last line of a truncated part, it can end with an incomplete base64 or quoted-printable group
+            text = text[: text.rfind(b"\n") + 1] or text
+        text = get_part_header(text_part[1]) + text
+    received = len(header) + len(text or b"")
+    stats.count("gmx.messages")
+    stats.count("gmx.bytes_received", received)
+    stats.count("gmx.bytes_skipped", max(size - received, 0))
+    return Message.from_parts(header, text, account.platform)
+
+
+def get_gmx_emails(account: Account = DEFAULT_ACCOUNT) -> Iterable[Message]:
     """Yield all messages on GMX."""
-    conn = imaplib.IMAP4_SSL("imap.gmx.com")
+    conn = connect(account)
     try:
-        conn.login(secrets["GMX_USER"], secrets["GMX_PASSWORD"])
-        conn.select(readonly=True)
-        _, data = conn.search(None, "(ALL)")
-        for num in data[0].split():
-            typ, data = conn.fetch(num, "(RFC822)")
-            if typ != "OK":
-                raise RuntimeError(f"Error getting message {num}")
-            yield Message.from_bytes(data[0][1], "gmx")  # type: ignore
+        for uid in get_uids(conn):
+            yield get_message(conn, uid, account)
     finally:
-        conn.close()
-        conn.logout()
+        disconnect(conn)
+
+
+def idle(conn: "imaplib.IMAP4", timeout: float = IDLE_TIMEOUT) -> bool:
+    """
+    Wait until the server reports a change in the inbox (with the IMAP IDLE command) or until the timeout.
+
+    Return True if the inbox has changed, False otherwise.
+    """
+    import select  # pylint: disable=C0415
+
+    tag = b"IDLE1"
+    conn.send(tag + b" IDLE\r\n")
+    line = conn.readline()
+    if not line.startswith(b"+"):
+        raise RuntimeError(f"The server doesn't support IDLE: {line.decode(errors='replace').strip()}")
+
+    changed = False
+    while not changed:
+        # SSL sockets can have decrypted data pending that select doesn't see
+        if not getattr(conn.sock, "pending", lambda: 0)() and not select.select([conn.sock], [], [], timeout)[0]:
+            break
+        line = conn.readline()
+        if not line:
+            raise EOFError("The IMAP server closed the connection")
+        changed = bool(re.match(rb"\* \d+ (EXISTS|EXPUNGE)", line))
+
+    conn.send(b"DONE\r\n")
+    while not (line := conn.readline()).startswith(tag):
+        if not line:
+            raise EOFError("The IMAP server closed the connection")
+    return changed
@@ -2,13 +2,17 @@
 
 import json
 import typing
+from collections import defaultdict
 from dataclasses import dataclass
-from typing import Mapping, MutableMapping, Optional
-from urllib.error import HTTPError
-from urllib.parse import urlencode
-from urllib.request import Request, urlopen
+from typing import AsyncIterator, Iterable, Iterator, Mapping, MutableMapping, Optional
+from urllib.parse import urlencode, urljoin, urlsplit
+
+from cassette import cassette
+from stats import stats
 
 if typing.TYPE_CHECKING:
+    import asyncio
+
     from oauth_token import Token
 
 
@@ -86,6 +90,20 @@ class Response:
 dumps = json.dumps
 
 
+def prepare(method, url, params=None, data=None, headers=None, json=None):  # pylint: disable=W0621
+    """Return the full URL, the body and the headers of a request."""
+    # For GET requests, if data is provided, use it instead of params
+    if method == "GET" and data:
+        params = data
+        data = None
+    headers = dict(headers or {})
+    if json:
+        headers["Content-Type"] = "application/json"
+        data = dumps(json)
+    body = None if data is None else data.encode() if isinstance(data, str) else urlencode(data).encode()
+    return url + ("?" + urlencode(params) if params else ""), body, headers
+
+
 def request(
     method,
     url,
@@ -96,32 +114,64 @@ def request(
     json=None,  # pylint: disable=W0621
 ):
     """Make a request."""
-    # For GET requests, if data is provided, use it instead of params
-    if method == "GET" and data:
-        params = data
-        data = None
-    if headers is None:
-        headers = {}
-    if token:
-        from oauth_token import Token
-
-        headers["Authorization"] = f"Bearer {token.access_token if isinstance(token, Token) else token}"
-    if json:
-        headers["Content-Type"] = "application/json"
-        data = dumps(json)
-    req = Request(
-        url + ("?" + urlencode(params) if params else ""),
-        data=None if data is None else data.encode() if isinstance(data, str) else urlencode(data).encode(),
-        headers=headers,
-        method=method,
-    )
-    try:
-        with urlopen(req) as resp:
-            return Response(resp.read(), resp.code, CaseInsensitiveDict(resp.headers))
-    except HTTPError as err:
-        # Attach the response to the error (we might need it)
-        err.response = Response(err.fp.read(), err.code, err.headers)  # type: ignore
-        raise
+    # urllib.request imports http.client and ssl, so we import it when we make the first request
+    from urllib.error import HTTPError  # pylint: disable=C0415
+    from urllib.request import Request, urlopen  # pylint: disable=C0415
+
+    from oauth_token import Token  # pylint: disable=C0415
+
+    url, body, headers = prepare(method, url, params, data, headers, json)
+
+    # If the token is rejected, validate it again (it will be refreshed if needed) and retry once
+    for attempt in range(2):
+        if token:
+            headers["Authorization"] = f"Bearer {token.access_token if isinstance(token, Token) else token}"
+        req = Request(url, data=body, headers=headers, method=method)
+        stats.count("http.requests")
+        stats.count("http.bytes_sent", len(body or b""))
+        with stats.timer("http"):
+            try:
+                if cassette.replaying:
+                    response = replay(method, url, body)
+                else:
+                    with urlopen(req) as resp:
+                        response = Response(resp.read(), resp.code, CaseInsensitiveDict(resp.headers))
+                    record(method, url, body, response)
+                stats.count("http.bytes_received", len(response.content))
+                if response.status_code < 400:
+                    return response
+                # Only replayed error responses get here (`urlopen` raises the errors)
+                err = HTTPError(
+                    url,
+                    response.status_code,
+                    f"HTTP Error {response.status_code}",
+                    response.headers,  # type: ignore
+                    None,
+                )
+                err.response = response  # type: ignore
+                raise err
+            except HTTPError as err:
+                # Attach the response to the error (we might need it)
+                if not hasattr(err, "response"):
+                    err.response = Response(err.fp.read(), err.code, err.headers)  # type: ignore
+                    record(method, url, body, err.response)  # type: ignore
+                stats.count("http.errors")
+                if err.code != 401 or attempt or not isinstance(token, Token):
+                    raise
+        token.revalidate()
+
+
+def record(method: str, url: str, body: bytes | None, response: Response):
+    """Record a response in the cassette (if it is recording and the response doesn't contain credentials)."""
+    if cassette.recording and not cassette.is_secret(url):
+        key = cassette.http_key(method, url, body)
+        cassette.record(key, (response.status_code, dict(response.headers), response.content))
+
+
+def replay(method: str, url: str, body: bytes | None) -> Response:
+    """Return the response of a request recorded in the cassette."""
+    status_code, headers, content = cassette.replay(cassette.http_key(method, url, body))
+    return Response(content, status_code, CaseInsensitiveDict(headers))
 
 
 def get(*args, **kwargs):
@@ -144,10 +194,9 @@ def delete(*args, **kwargs):
     return request("DELETE", *args, **kwargs)
 
 
-def get_with_pages(url, params=None, *args, **kwargs):  # pylint: disable=W1113
-    """Return paginated data from a Google API."""
-    if params is None:
-        params = {}
+def get_pages(url, params=None, *args, page_size: int | None = None, **kwargs):  # pylint: disable=W1113
+    """Yield the pages of paginated data from a Google API (with `maxResults=page_size` if it is set)."""
+    params = {**(params or {}), **({"maxResults": page_size} if page_size else {})}
 
     next_page_token = None
     while True:
@@ -160,11 +209,312 @@ def get_with_pages(url, params=None, *args, **kwargs):  # pylint: disable=W1113
             *args,
             **kwargs,
         ).json()
+        yield data
+
+        next_page_token = data.get("nextPageToken")
+        if next_page_token is None:
+            break
 
+
+def read_ahead(iterable: Iterable, size: int) -> Iterator:
+    """Yield the values of an iterable, getting up to `size` values in advance from a background thread."""
+    import queue  # pylint: disable=C0415
+    import threading  # pylint: disable=C0415
+
+    values: queue.Queue = queue.Queue(size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        """Add an item to the queue, unless the consumer stops first (return False in this case)."""
+        while not stop.is_set():
+            try:
+                values.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for value in iterable:
+                # Stop if the consumer doesn't need more values
+                if not put((value, None)):
+                    return
+            put((done, None))
+        except Exception as err:  # pylint: disable=W0718
+            put((done, err))
+        finally:
+            # Release the resources of the iterable (e.g. a connection) if it is a generator
+            if close := getattr(iterable, "close", None):
+                close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            value, err = values.get()
+            if err:
+                raise err
+            if value is done:
+                return
+            yield value
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting for a free slot
+        while not values.empty():
+            values.get_nowait()
+
+
+def get_with_pages(  # pylint: disable=W1113
+    url, params=None, *args, page_size: int | None = None, prefetch=0, **kwargs
+):
+    """
+    Return paginated data from a Google API.
+
+    Use `page_size` to request larger pages (`maxResults`), and `prefetch` to get up to this number of pages
+    in a background thread while the current page is being consumed.
+    """
+    pages = get_pages(url, params, *args, page_size=page_size, **kwargs)
+    if prefetch:
+        pages = read_ahead(pages, prefetch)
+    for data in pages:
         for value in data.values():
             if isinstance(value, list):
                 yield from value
 
-        next_page_token = data.get("nextPageToken")
-        if next_page_token is None:
-            break
+
+class AsyncClient:
+    """
+    An asyncio HTTP/1.1 client that keeps the connections alive and limits the number of connections per host.
+
+    It returns the same `Response` objects and raises the same errors as `request`:
+
+        async with AsyncClient() as client:
+            responses = await asyncio.gather(*(client.get(url, token=token) for url in urls))
+    """
+
+    # The maximum number of redirections to follow
+    max_redirects = 5
+
+    def __init__(self, limit_per_host=10, timeout: float = 60):
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        # The idle connections, by (scheme, host, port)
+        self._idle: dict[tuple[str, str, int], list[tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = defaultdict(
+            list
+        )
+        self._semaphores: dict[tuple[str, str, int], asyncio.Semaphore] = {}
+        self._ssl_context = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """Close the idle connections."""
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+    async def open_connection(self, scheme: str, host: str, port: int):
+        """Open a new connection to a host."""
+        import asyncio  # pylint: disable=C0415
+        import ssl  # pylint: disable=C0415
+
+        if scheme == "https" and self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return await asyncio.open_connection(host, port, ssl=self._ssl_context if scheme == "https" else None)
+
+    async def request(
+        self,
+        method,
+        url,
+        params=None,
+        data=None,
+        headers=None,
+        token: Optional["Token | str"] = None,
+        json=None,  # pylint: disable=W0621
+    ) -> Response:
+        """Make a request."""
+        import asyncio  # pylint: disable=C0415
+        from urllib.error import HTTPError  # pylint: disable=C0415
+
+        from oauth_token import Token  # pylint: disable=C0415
+
+        url, body, headers = prepare(method, url, params, data, headers, json)
+
+        # If the token is rejected, validate it again (it will be refreshed if needed) and retry once
+        for attempt in range(2):
+            if token:
+                headers["Authorization"] = f"Bearer {token.access_token if isinstance(token, Token) else token}"
+            stats.count("http.requests")
+            stats.count("http.bytes_sent", len(body or b""))
+            if cassette.replaying:
+                response = replay(method, url, body)
+            else:
+                response = await self._send(method, url, body, headers)
+                record(method, url, body, response)
+            stats.count("http.bytes_received", len(response.content))
+            if response.status_code < 400:
+                return response
+
+            err = HTTPError(
+                url,
+                response.status_code,
+                f"HTTP Error {response.status_code}",
+                response.headers,  # type: ignore
+                None,
+            )
+            # Attach the response to the error, like `request`
+            err.response = response  # type: ignore
+            stats.count("http.errors")
+            if response.status_code != 401 or attempt or not isinstance(token, Token):
+                raise err
+            await asyncio.to_thread(token.revalidate)
+        raise AssertionError("unreachable")
+
+    async def _send(self, method: str, url: str, body: bytes | None, headers: dict[str, str]) -> Response:
+        """Send a request, following the redirections."""
+        import asyncio  # pylint: disable=C0415
+
+        for _ in range(self.max_redirects + 1):
+            async with asyncio.timeout(self.timeout):
+                response = await self._send_once(method, url, body, headers)
+            if response.status_code not in (301, 302, 303, 307, 308) or "Location" not in response.headers:
+                return response
+            url = urljoin(url, response.headers["Location"])
+            if response.status_code == 303 or response.status_code in (301, 302) and method == "POST":
+                method, body = "GET", None
+        raise OSError(f"Too many redirections for {url}")
+
+    async def _send_once(self, method: str, url: str, body: bytes | None, headers: dict[str, str]) -> Response:
+        """Send a request without following the redirections (at most `limit_per_host` at the same time per host)."""
+        import asyncio  # pylint: disable=C0415
+
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        key = (scheme, parts.hostname or "", parts.port or (443 if scheme == "https" else 80))
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.limit_per_host)
+
+        host = parts.netloc.rpartition("@")[2]
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        head = [f"{method} {target} HTTP/1.1", f"Host: {host}", "Accept-Encoding: identity"]
+        if body is not None or method in ("POST", "PUT", "PATCH"):
+            head.append(f"Content-Length: {len(body or b'')}")
+        head.extend(f"{name}: {value}" for name, value in headers.items())
+        data = ("\r\n".join(head) + "\r\n\r\n").encode() + (body or b"")
+
+        async with self._semaphores[key]:
+            with stats.timer("http"):
+                return await self._exchange(key, data, method)
+
+    async def _exchange(self, key: tuple[str, str, int], data: bytes, method: str) -> Response:
+        """Send the data of a request on a kept-alive connection (or a new one) and read the response."""
+        import asyncio  # pylint: disable=C0415
+
+        while True:
+            reused = bool(self._idle[key])
+            reader, writer = self._idle[key].pop() if reused else await self.open_connection(*key)
+            try:
+                writer.write(data)
+                await writer.drain()
+                response, keep_alive = await self._read_response(reader, method)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # The server may have closed an idle connection: try again with another one
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            if keep_alive:
+                self._idle[key].append((reader, writer))
+            else:
+                writer.close()
+            return response
+
+    @staticmethod
+    async def _read_response(reader: "asyncio.StreamReader", method: str) -> tuple[Response, bool]:
+        """Read a response. Return it and True if the connection can be reused."""
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError("The server closed the connection")
+            version, status, *_ = status_line.decode("latin-1").split(" ", 2)
+            status_code = int(status)
+            headers = CaseInsensitiveDict()
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip()] = value.strip()
+            # Skip the informational responses (e.g. 100 Continue)
+            if not 100 <= status_code < 200:
+                break
+
+        keep_alive = version == "HTTP/1.1" and headers.get("Connection", "").lower() != "close"
+        if method == "HEAD" or status_code in (204, 304):
+            content = b""
+        elif "chunked" in headers.get("Transfer-Encoding", "").lower():
+            chunks = []
+            while size := int((await reader.readline()).split(b";")[0], 16):
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            # Skip the trailers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            content = b"".join(chunks)
+        elif "Content-Length" in headers:
+            content = await reader.readexactly(int(headers["Content-Length"]))
+        else:
+            # The body ends when the connection is closed
+            content = await reader.read()
+            keep_alive = False
+        return Response(content, status_code, headers), keep_alive
+
+    async def get(self, *args, **kwargs):
+        """Make a GET request."""
+        return await self.request("GET", *args, **kwargs)
+
+    async def post(self, *args, **kwargs):
+        """Make a POST request."""
+        return await self.request("POST", *args, **kwargs)
+
+    async def put(self, *args, **kwargs):
+        """Make a PUT request."""
+        return await self.request("PUT", *args, **kwargs)
+
+    async def delete(self, *args, **kwargs):
+        """Make a DELETE request."""
+        return await self.request("DELETE", *args, **kwargs)
+
+    async def get_with_pages(  # pylint: disable=W1113
+        self, url, params=None, *args, page_size: int | None = None, **kwargs
+    ) -> AsyncIterator:
+        """Yield paginated data from a Google API (with `maxResults=page_size` if it is set)."""
+        params = {**(params or {}), **({"maxResults": page_size} if page_size else {})}
+
+        next_page_token = None
+        while True:
+            response = await self.get(
+                url,
+                {
+                    **params,
+                    **({"pageToken": next_page_token} if next_page_token else {}),
+                },
+                *args,
+                **kwargs,
+            )
+            data = response.json()
+
+            for value in data.values():
+                if isinstance(value, list):
+                    for item in value:
+                        yield item
+
+            next_page_token = data.get("nextPageToken")
+            if next_page_token is None:
+                break
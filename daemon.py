@@ -0,0 +1,264 @@
+"""A long-running process that creates Todoist tasks a few seconds after an email is received.
+
+Instead of fetching everything every 30 minutes, it keeps an IMAP IDLE connection to GMX, polls the Gmail history
+(or waits for a Pub/Sub push on a local HTTP endpoint) and keeps the Todoist sync status in memory, so only the changed
+messages are processed.
+"""
+
+import base64
+import json
+import queue
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import check_gmail_emails
+import check_gmx_emails
+from accounts import Account, get_accounts
+from email_utils import Message
+from get_secrets import secrets
+from message_cache import MessageCache
+from pipeline import get_sync_status, handle_message_list, send_todoist_errors
+from stats import stats
+from todoist import SyncStatus
+
+# Time to wait before reconnecting after an error (doubled after each error)
+MIN_BACKOFF = 5
+MAX_BACKOFF = 15 * 60
+# Time to wait for other changes before processing a change (to process them together)
+DEBOUNCE = 1
+
+
+@dataclass
+class Change:
+    """A change in a mailbox."""
+
+    platform: str
+    # The new messages (or all the messages if `full` is True)
+    added: list[Message] = field(default_factory=list)
+    # The hashed IDs of the removed messages
+    removed: set[str] = field(default_factory=set)
+    # True if `added` contains all the messages of the mailbox
+    full: bool = False
+    # The errors of the watcher (`added` contains their error messages)
+    errors: list[Exception] = field(default_factory=list)
+
+
+class Daemon:
+    """Watch the mailboxes and sync the changes with Todoist."""
+
+    def __init__(self, gmail_interval: float = 30, push_port: int | None = None):
+        self.gmail_interval = gmail_interval
+        self.push_port = push_port
+        self.changes: queue.Queue[Change] = queue.Queue()
+        self.stop = threading.Event()
+        self.accounts = [*get_accounts("gmail"), *get_accounts("gmx")]
+        # Set to poll the Gmail history of an account immediately (by platform)
+        self.gmail_wake = {account.platform: threading.Event() for account in self.accounts}
+        # The hashed IDs of the messages in each mailbox (by platform)
+        self.known: dict[str, set[str]] = {account.platform: set() for account in self.accounts}
+        # The platforms whose watcher has sent the full list of messages (the other ones are not known yet)
+        self.listed: set[str] = set()
+
+    def run(self):
+        """Start the watchers and process the changes until `stop` is set."""
+        watchers = {"gmail": self.watch_gmail, "gmx": self.watch_gmx}
+        threads = [
+            threading.Thread(target=self.watch, args=(account, watchers[account.provider]), daemon=True)
+            for account in self.accounts
+        ]
+        if self.push_port:
+            threads.append(threading.Thread(target=self.serve_push, daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            self.process_changes()
+        finally:
+            self.stop.set()
+
+    def process_changes(self):
+        """Process the changes sent by the watchers until `stop` is set."""
+        status = None
+        # The changes of a failed cycle (processed again before the next ones, after a backoff)
+        failed: list[Change] = []
+        backoff = MIN_BACKOFF
+        while not self.stop.is_set():
+            try:
+                changes = [self.changes.get(timeout=1)]
+                # Wait a bit to process the changes that come together
+                time.sleep(DEBOUNCE)
+            except queue.Empty:
+                if not failed:
+                    continue
+                changes = []
+            while not self.changes.empty():
+                changes.append(self.changes.get())
+            changes = [*failed, *changes]
+
+            try:
+                if status is None:
+                    status = get_sync_status(max_age=0)
+                else:
+                    # Get the changes made on Todoist since the last sync
+                    status.sync()
+                self.process(changes, status)
+                failed = []
+                backoff = MIN_BACKOFF
+            except Exception as err:  # pylint: disable=W0718
+                traceback.print_exception(err)
+                # Send the errors of the cycle together (the tasks of the watcher errors have not been created)
+                send_todoist_errors([err, *(error for change in changes for error in change.errors)])
+                # Start again from a full sync, and process the changes again (the new messages would be lost)
+                status = None
+                failed = changes
+                self.stop.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+            stats.report()
+            stats.reset()
+
+    def process(self, changes: list[Change], status: SyncStatus):
+        """Sync a list of changes with Todoist (the known messages are only updated if it succeeds)."""
+        known = {platform: set(hashed_ids) for platform, hashed_ids in self.known.items()}
+        listed = set(self.listed)
+        added: dict[str, Message] = {}
+        for change in changes:
+            if change.full:
+                known[change.platform] = set()
+                listed.add(change.platform)
+                for hashed_id in list(added):
+                    if hashed_id.startswith(f"{change.platform}_"):
+                        del added[hashed_id]
+            known[change.platform] -= change.removed
+            for message in change.added:
+                known[change.platform].add(message.hashed_id)
+                added[message.hashed_id] = message
+            for hashed_id in change.removed:
+                added.pop(hashed_id, None)
+
+        print(f"Processing {len(added)} new messages")
+        unchanged = set().union(*known.values()) - added.keys()
+        # Only close the tasks of the platforms whose watcher has sent the full list of messages
+        handle_message_list(added.values(), status, unchanged, listed)
+        self.known = known
+        self.listed = listed
+
+    def watch(self, account: Account, watcher):
+        """Run the watcher of an account again after an error, with an exponential backoff."""
+        backoff = MIN_BACKOFF
+        while not self.stop.is_set():
+            start = time.monotonic()
+            try:
+                watcher(account)
+            except Exception as err:  # pylint: disable=W0718
+                traceback.print_exception(err)
+                # Keep the known messages: they will be replaced by the full list when the watcher works again
+                self.changes.put(Change(account.platform, [Message.error(err, account.platform)], errors=[err]))
+            # Reset the backoff if the watcher ran for a long time
+            if time.monotonic() - start > MAX_BACKOFF:
+                backoff = MIN_BACKOFF
+            self.stop.wait(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def watch_gmail(self, account: Account):
+        """Send the changes of a Gmail inbox until `stop` is set."""
+        wake = self.gmail_wake[account.platform]
+        # None when a full sync is needed (at the start or when the history ID is too old)
+        history_id: str | None = None
+        # The hashed ID of each message (by Gmail message ID)
+        hashed_ids: dict[str, str] = {}
+        while not self.stop.is_set():
+            if history_id is None:
+                # Get the history ID before the messages to be sure that we don't miss a change
+                history_id = check_gmail_emails.get_history_id(account)
+                message_ids = list(check_gmail_emails.get_gmail_message_ids(account))
+                messages = check_gmail_emails.get_gmail_messages(message_ids, account)
+                check_gmail_emails.prune_cache(message_ids, account)
+                hashed_ids = {message_id: message.hashed_id for message_id, message in zip(message_ids, messages)}
+                self.changes.put(Change(account.platform, messages, full=True))
+                continue
+
+            wake.wait(self.gmail_interval)
+            wake.clear()
+            try:
+                added, removed, history_id = check_gmail_emails.get_gmail_changes(history_id, account)
+            except OSError as err:
+                # The history ID is too old: start again from a full sync
+                if getattr(err, "code", None) == 404:
+                    history_id = None
+                    continue
+                raise
+            change = Change(account.platform)
+            new_ids = list(added - hashed_ids.keys())
+            change.added = check_gmail_emails.get_gmail_messages(new_ids, account)
+            hashed_ids.update((message_id, message.hashed_id) for message_id, message in zip(new_ids, change.added))
+            change.removed = {hashed_ids.pop(message_id) for message_id in removed & hashed_ids.keys()}
+            MessageCache(account).delete(removed)
+            if change.added or change.removed:
+                self.changes.put(change)
+
+    def watch_gmx(self, account: Account):
+        """Send the changes of a GMX inbox until `stop` is set."""
+        conn = check_gmx_emails.connect(account)
+        try:
+            # The hashed ID of each message (by UID)
+            hashed_ids = {}
+            messages = []
+            for uid in check_gmx_emails.get_uids(conn):
+                messages.append(check_gmx_emails.get_message(conn, uid, account))
+                hashed_ids[uid] = messages[-1].hashed_id
+            self.changes.put(Change(account.platform, messages, full=True))
+
+            while not self.stop.is_set():
+                # Search the messages again even after a timeout, in case we missed a notification
+                check_gmx_emails.idle(conn)
+                uids = set(check_gmx_emails.get_uids(conn))
+                change = Change(account.platform)
+                for uid in sorted(uids - hashed_ids.keys(), key=int):
+                    change.added.append(check_gmx_emails.get_message(conn, uid, account))
+                    hashed_ids[uid] = change.added[-1].hashed_id
+                change.removed = {hashed_ids.pop(uid) for uid in hashed_ids.keys() - uids}
+                if change.added or change.removed:
+                    self.changes.put(change)
+        finally:
+            check_gmx_emails.disconnect(conn)
+
+    def serve_push(self):
+        """Receive Pub/Sub push notifications for the Gmail inboxes on a local HTTP endpoint."""
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):  # pylint: disable=C0103
+                # If a token is configured, check it (Pub/Sub sends it in the query string)
+                push_token = secrets.get("GMAIL_PUSH_TOKEN")
+                query = parse_qs(urlsplit(self.path).query)
+                if push_token and query.get("token", [""])[0] != push_token:
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                try:
+                    data = json.loads(base64.b64decode(json.loads(body)["message"]["data"]))
+                    print(f"Gmail push notification (history ID {data.get('historyId')})")
+                except (ValueError, KeyError, TypeError):
+                    pass
+                # We don't know the address of each account, so we poll all of them
+                for wake in daemon.gmail_wake.values():
+                    wake.set()
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):  # pylint: disable=W0622
+                pass
+
+        with ThreadingHTTPServer(("127.0.0.1", self.push_port), Handler) as server:  # type: ignore
+
+            def shutdown():
+                self.stop.wait()
+                server.shutdown()
+
+            threading.Thread(target=shutdown, daemon=True).start()
+            server.serve_forever()
@@ -3,6 +3,7 @@ import re
 from typing import Any
 
 from email_utils import Message
+from stats import stats
 from todoist import SyncStatus, Task
 
 
@@ -14,6 +15,11 @@ class EmailParser:
     @classmethod
     def parse_email(cls, message: Message, status: SyncStatus):
         """Parse an email and return a task that corresponds to it."""
+        with stats.timer("match"):
+            return cls._parse_email(message, status)
+
+    @classmethod
+    def _parse_email(cls, message: Message, status: SyncStatus):
         # Set the due date 7 days after the received date
         # If we received the message after 19:00, add one more day
         due_date = dt.datetime.combine(
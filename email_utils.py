@@ -2,20 +2,20 @@
 
 import base64
 import datetime as dt
-import email.header
-import email.message
-import email.policy
-import email.utils
 import hashlib
-import traceback
+import typing
 from dataclasses import dataclass
 from functools import cached_property
-from html.parser import HTMLParser
-from io import StringIO
 from typing import Self
-from zoneinfo import ZoneInfo
 
 import custom_requests
+from stats import stats
+
+if typing.TYPE_CHECKING:
+    import email.message
+
+# The modules that are only needed when parsing messages are imported in the functions that use them
+# to keep the startup time of `main.py` low.
 
 
 @dataclass
@@ -33,21 +33,46 @@ class Message:
     @classmethod
     def from_bytes(cls, data: bytes, platform: str) -> Self:
         """Create a `Message` from its bytes representation."""
-        msg = email.message_from_bytes(data, policy=email.policy.default)
+        import email.policy  # pylint: disable=C0415
+
+        with stats.timer("parse"):
+            msg = email.message_from_bytes(data, policy=email.policy.default)
+            return cls.from_email(msg, get_body(msg), platform)
+
+    @classmethod
+    def from_parts(cls, header: bytes, text_part: bytes | None, platform: str) -> Self:
+        """
+        Create a `Message` from its header and the text part used for its body (with the MIME header of the part).
+
+        This is used when the parts are fetched separately, without the attachments (`text_part` can be truncated).
+        """
+        import email.policy  # pylint: disable=C0415
+
+        with stats.timer("parse"):
+            msg = email.message_from_bytes(header, policy=email.policy.default)
+            body = get_body(email.message_from_bytes(text_part, policy=email.policy.default)) if text_part else ""
+            return cls.from_email(msg, body, platform)
+
+    @classmethod
+    def from_email(cls, msg: "email.message.Message", body: str, platform: str) -> Self:
+        """Create a `Message` from a parsed email and its body."""
+        import email.utils  # pylint: disable=C0415
+        from zoneinfo import ZoneInfo  # pylint: disable=C0415
+
         headers = custom_requests.CaseInsensitiveDict(msg)
 
-        date: dt.datetime = email.utils.parsedate_to_datetime(headers["Received"].split(";")[-1].strip()).astimezone(
-            ZoneInfo("Europe/Paris")
-        )
+        received = headers["Received"].split(";")[-1].strip()
+        date: dt.datetime = email.utils.parsedate_to_datetime(received).astimezone(ZoneInfo("Europe/Paris"))
         sender = headers["From"]
         subject = headers["Subject"]
-        body = get_body(msg)
 
         return cls(headers["Message-ID"], sender, subject, date, headers, body, platform)
 
     @classmethod
     def error(cls, error: Exception, platform: str):
         """Create a `Message` for an error."""
+        import traceback  # pylint: disable=C0415
+
         return cls(
             "error",
             "",
@@ -68,22 +93,7 @@ class Message:
         )
 
 
-class TagsStripper(HTMLParser):
-    """A HTML parser that strips tags."""
-
-    def __init__(self):
-        super().__init__()
-        self.text = StringIO()
-
-    def handle_data(self, data):
-        self.text.write(data)
-
-    def get_data(self):
-        """Return the text in the parsed HTML."""
-        return self.text.getvalue()
-
-
-def get_body(msg: email.message.Message) -> str:
+def get_body(msg: "email.message.Message") -> str:
     """Return the body of a `Message` as plain text."""
     for part in msg.walk():
         if part.get_content_type() == "text/plain":
@@ -91,6 +101,8 @@ def get_body(msg: email.message.Message) -> str:
 
     for part in msg.walk():
         if part.get_content_type() == "text/html":
+            from tags_stripper import TagsStripper  # pylint: disable=C0415
+
             parser = TagsStripper()
             parser.feed(part.get_payload(decode=True).decode(errors="replace"))
             return parser.get_data()
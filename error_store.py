@@ -0,0 +1,95 @@
+"""A persistent store of the errors that have been reported by email, to avoid sending the same error again."""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+
+from get_secrets import secrets
+
+# Don't send an email for an error that has already been sent in the last number of seconds
+ERROR_EMAIL_WINDOW = float(secrets.get("ERROR_EMAIL_WINDOW", str(24 * 60 * 60)))
+
+
+def error_text(err: Exception) -> str:
+    """Return the text that identifies an error (without the parts that change every time)."""
+    # Remove UUIDs from the error message
+    return re.sub(r"\b[0-9a-f-]{36}\b", "[UUID]", f"{type(err).__name__}: {err}")
+
+
+class ErrorStore:
+    """
+    The errors seen recently, with the first and last time they have been seen, the number of times they have been
+    seen and the last time they have been sent.
+
+    The store is read when it is opened and saved when it is closed:
+
+        with ErrorStore() as store:
+            if not store.seen(err):
+                ...
+                store.sent(err)
+
+    Only one thread can open the store at a time.
+    """
+
+    lock = threading.Lock()
+
+    def __init__(self, window: float = ERROR_EMAIL_WINDOW):
+        self.window = window
+        self.file = Path(__file__).parent / "cache/error_emails.json"
+        self.errors: dict[str, dict] = {}
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            if self.file.exists():
+                self.errors = json.loads(self.file.read_text("utf-8"))
+            else:
+                # Remove the lockfiles used by older versions
+                for file in self.file.parent.glob("error_email_*"):
+                    file.unlink()
+        except BaseException:
+            self.lock.release()
+            raise
+        # Forget the errors that haven't been seen for a while
+        now = time.time()
+        self.errors = {key: error for key, error in self.errors.items() if error["last_seen"] + self.window > now}
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            new_file = self.file.with_name(self.file.name + ".new")
+            new_file.write_text(json.dumps(self.errors), "utf-8")
+            new_file.replace(self.file)
+        finally:
+            self.lock.release()
+
+    @staticmethod
+    def key(err: Exception) -> str:
+        return hashlib.sha256(error_text(err).encode()).hexdigest()[:16]
+
+    def seen(self, err: Exception) -> bool:
+        """Record an occurrence of an error. Return True if it has been sent in the suppression window."""
+        now = time.time()
+        error = self.errors.setdefault(
+            self.key(err), {"text": error_text(err)[:200], "first_seen": now, "count": 0, "last_sent": None}
+        )
+        error["last_seen"] = now
+        error["count"] += 1
+        return error["last_sent"] is not None and error["last_sent"] + self.window > now
+
+    def sent(self, err: Exception):
+        """Record that an error has been sent."""
+        self.errors[self.key(err)]["last_sent"] = time.time()
+
+    def unsent(self, err: Exception):
+        """Record that sending an error has failed, so it is sent again next time."""
+        if error := self.errors.get(self.key(err)):
+            error["last_sent"] = None
+
+    def get(self, err: Exception) -> dict:
+        """Return the record of an error."""
+        return self.errors[self.key(err)]
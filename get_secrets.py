@@ -1,8 +1,9 @@
 """A dict that returns secrets from environment variables or from the `.env` file."""
 
 import os
+from contextlib import contextmanager
 from pathlib import Path
-from threading import Lock
+from threading import RLock
 from typing import overload
 
 NOT_PROVIDED = object()
@@ -13,7 +14,11 @@ class Secrets(dict):
 
     def __init__(self):
         super().__init__()
-        self.lock = Lock()
+        # Reentrant because the changes made in a batch are made while holding it
+        self.lock = RLock()
+        # The number of nested batches and True if there are unsaved changes
+        self.batch_depth = 0
+        self.dirty = False
         self.reload()
 
     def __getitem__(self, key):
@@ -36,48 +41,106 @@ class Secrets(dict):
     def setdefault(self, key, default: str | None = None) -> str:
         if key not in self and key in os.environ:
             return os.environ[key]
-        return super().setdefault(key, default)
+        if key not in self:
+            self[key] = default
+        return super().__getitem__(key)
 
     def pop(self, key, default=NOT_PROVIDED):
-        if default is NOT_PROVIDED:
-            ret = super().pop(key)
-        else:
-            ret = super().pop(key, default)
-        self.save()
+        with self.batch():
+            if default is NOT_PROVIDED:
+                ret = super().pop(key)
+            else:
+                ret = super().pop(key, default)
+            self.changed()
         return ret
 
     def popitem(self):
-        ret = super().popitem()
-        self.save()
+        with self.batch():
+            ret = super().popitem()
+            self.changed()
         return ret
 
     def __setitem__(self, key, value):
-        super().__setitem__(key, value)
-        self.save()
+        with self.batch():
+            super().__setitem__(key, value)
+            self.changed()
+
+    def update(self, *args, **kwargs):
+        with self.batch():
+            super().update(*args, **kwargs)
+            self.changed()
 
     def clear(self):
-        super().clear()
-        self.save()
+        with self.batch():
+            super().clear()
+            self.changed()
+
+    @contextmanager
+    def batch(self):
+        """
+        Save the changes made in this context once at the end (and block the changes from other threads meanwhile).
+
+            with secrets.batch():
+                secrets["A"] = "a"
+                secrets["B"] = "b"
+        """
+        with self.lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if not self.batch_depth and self.dirty:
+                    self.save()
+
+    def changed(self):
+        """Save the secrets, or at the end of the current batch."""
+        with self.lock:
+            self.dirty = True
+            if not self.batch_depth:
+                self.save()
 
     def reload(self):
-        super().clear()
-
-        self.file = Path(__file__).parent / ".env"
-        if self.file.exists():
-            with self.file.open() as f:
-                for line in f:
-                    key, _, value = line[:-1].partition("=")
-                    self[key] = value
+        with self.lock:
+            super().clear()
+
+            self.file = Path(__file__).parent / ".env"
+            signature = self.get_signature()
+            if signature:
+                with self.file.open() as f:
+                    for line in f:
+                        if line.strip():
+                            key, _, value = line.removesuffix("\n").partition("=")
+                            # Don't save the file while loading it
+                            super().__setitem__(key, value)
+            self.signature = signature
+            self.dirty = False
+
+    def reload_if_changed(self):
+        """Reload the secrets if the `.env` file has been modified by another process."""
+        if self.get_signature() != self.signature:
+            self.reload()
+
+    def get_signature(self) -> tuple[int, int] | None:
+        """Return the modification time and the size of the `.env` file (None if it doesn't exist)."""
+        try:
+            stat = self.file.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
 
     def save(self):
-        """Save the secrets to the `.env` file."""
+        """Save the secrets to the `.env` file, atomically."""
         with self.lock:
             new_file = self.file.with_name(self.file.name + ".new")
-            new_file.touch()
             with new_file.open("w") as f:
                 for key, value in self.items():
                     f.write(f"{key}={value}\n")
+                f.flush()
+                os.fsync(f.fileno())
             new_file.replace(self.file)
+            self.signature = self.get_signature()
+            self.dirty = False
 
 
 secrets = Secrets()
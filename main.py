@@ -1,185 +1,117 @@
 """The main entry point to run this program."""
 
-import hashlib
-import re
-import traceback
 from pathlib import Path
-from typing import Iterable
 
+from accounts import Account, get_accounts
+from cassette import DEFAULT_FILE as DEFAULT_CASSETTE
+from cassette import cassette
 from check_gmail_emails import get_gmail_emails
 from check_gmx_emails import get_gmx_emails
-from email_parser import EmailParser
 from email_utils import Message
-from get_secrets import secrets
-from send_email import send_email
-from todoist import Comment, SyncStatus, Task
-
-
-def send_todoist_error(err: Exception):
-    """Send an email with the Todoist sync error message to the user."""
-    # If we don't need to send the error, stop here
-    if isinstance(err, OSError):
-        err_to_check = err
-        while err_to_check:
-            if any(message in str(err_to_check) for message in ("Bad Gateway", "Service Unavailable")):
-                return
-            err_to_check = err_to_check.__context__
-
-    subject = "An error occurred while adding tasks to Todoist"
-    message = f"""\
-An error occurred while adding tasks to Todoist:
-{type(err).__name__}: {err}
-
-{"".join(traceback.format_exception(err))}
-"""
-    html_message = f"""\
-<!DOCTYPE html>
-<html>
-<head>
-<title>{subject}</title>
-</head>
-<body>
-<p>An error occurred while adding tasks to Todoist:</p>
-<p><b>{type(err).__name__}</b>: {err}</p>
-<pre>{"".join(traceback.format_exception(err))}</pre>
-</body>
-</html>
-"""
-    lock_text = f"{type(err).__name__}: {err}"
-    # Remove UUIDs from the error message
-    lock_text = re.sub(r"\b[0-9a-f-]{36}\b", "[UUID]", lock_text)
-    hash = hashlib.sha256(lock_text.encode()).hexdigest()
-    lockfile = Path(__file__).parent / f"cache/error_email_{hash}"
-    if lockfile.exists():
-        print("Error email already sent")
-        return
-    cleanup_lockfiles()
-    lockfile.touch()
-    send_email(secrets["GMX_USER"], subject, message, html_message)
-    print("Error email sent")
-
-
-def cleanup_lockfiles():
-    # Remove old error lockfiles
-    print("Cleaning up error lockfiles")
-    for file in Path(__file__).parent.glob("cache/error_email_*"):
-        file.unlink()
-
-
-def handle_message_list(messages: Iterable[Message]):
-    """
-    Compare a message list with the message IDs present in the tasks and call the
-    `handle_new_message` and `handle_deleted_message` functions.
-    """
-    status = SyncStatus(["items", "notes"])
-
-    tasks = Task.all(status)
-
-    seen_hashed_message_ids: list[str] = []
-
-    # New messages
-    for message in messages:
-        print(f"Message: {message.hashed_id}")
-        seen_hashed_message_ids.append(message.hashed_id)
-        handle_new_message(message, tasks, status)
-        print()
-
-    # Deleted messages
-    check_deleted_messages(tasks, seen_hashed_message_ids)
-
-    # Send the changes to Todoist
-    status.sync()
-
-
-def handle_new_message(message: Message, tasks: list[Task], status: SyncStatus):
-    """Handle a new message: create a task and remove the duplicate tasks."""
-    # The ID of an already created task about this message
-    old_task_id = None
-    for task in tasks:
-        for comment in task.get_all_comments():
-            if message.hashed_id in comment.content:
-                if old_task_id is None:
-                    # If it's the first task we see, save its ID to edit it
-                    print("    Task found")
-                    old_task_id = task.id
-                else:
-                    # Otherwise, delete the task because it's a duplicate
-                    task.delete()
-                    # Keep our list in sync with Todoist
-                    tasks.remove(task)
-                    print("    Duplicate task deleted")
-
-    if old_task_id is None:
-        print("    New message")
-
-    task = EmailParser.parse_email(message, status)
-    task._id = old_task_id
-    task.save()
-    tasks.append(task)
-
-    if not old_task_id:
-        Comment(task, f"ID : {message.hashed_id}", status=status).save()
-        print("    Task created")
-    else:
-        for comment in task.get_all_comments():
-            if message.hashed_id in comment.content:
-                break
-        else:
-            Comment(task, f"ID : {message.hashed_id}", status=status).save()
-        print("    Task updated")
-
-
-def check_deleted_messages(tasks: list[Task], seen_hashed_message_ids: list[str]):
-    """Check for deleted messages and close or delete the associated tasks."""
-
-    # Hashed IDs of messages for which the task has been closed
-    closed_tasks_hashed_message_ids: list[str] = []
-
-    for task in tasks:
-        for comment in task.get_all_comments():
-            # Search for the ID
-            match = re.match(r"^ID : (.*?)$", comment.content)
-            if not match:
-                continue
-            hashed_id = match[1]
-            # If the ID is in the seen messages, stop here
-            if hashed_id in seen_hashed_message_ids:
-                break
-
-            print(f"Deleted message: {hashed_id}")
-
-            if hashed_id not in closed_tasks_hashed_message_ids:
-                # If the task hasn't been closed, close it
-                closed_tasks_hashed_message_ids.append(hashed_id)
-                task.close()
-                print("Task closed")
-            else:
-                # Otherwise, delete it
-                task.delete()
-                # Keep our list in sync with Todoist
-                tasks.remove(task)
-                print("Duplicate task deleted")
+from pipeline import handle_message_list, send_todoist_errors
+from stats import stats
 
 
-if __name__ == "__main__":
-    emails = []
-
+def get_emails(account: Account, errors: list[Exception]) -> list[Message]:
+    """Return all the emails of an account (or an error message, and add the error to `errors`)."""
+    get_account_emails = {"gmail": get_gmail_emails, "gmx": get_gmx_emails}[account.provider]
     try:
-        emails.extend(get_gmail_emails())
+        with stats.timer(account.platform):
+            return list(get_account_emails(account))
     except Exception as err:  # pylint: disable=W0718
-        emails.append(Message.error(err, "gmail"))
+        errors.append(err)
+        return [Message.error(err, account.platform)]
 
-    try:
-        emails.extend(get_gmx_emails())
-    except Exception as err:  # pylint: disable=W0718
-        emails.append(Message.error(err, "gmx"))
+
+def run():
+    """Fetch all the emails and sync them with Todoist."""
+    from concurrent.futures import ThreadPoolExecutor  # pylint: disable=C0415
+
+    # Fetch the accounts concurrently (they are independent, and there can be none)
+    accounts = [*get_accounts("gmail"), *get_accounts("gmx")]
+    # The errors of the accounts (they are also added as tasks)
+    errors: list[Exception] = []
+    with ThreadPoolExecutor(max(len(accounts), 1)) as executor:
+        emails = [email for emails in executor.map(get_emails, accounts, [errors] * len(accounts)) for email in emails]
 
     try:
-        handle_message_list(emails)
+        with stats.timer("todoist"):
+            handle_message_list(emails)
     except Exception as err:  # pylint: disable=W0718
         # we catch all possible errors because if a command exceeds
         # the `MAX_COMMANDS` threshold, it will immediately sync
-        send_todoist_error(err)
+        # (the tasks of the account errors may not have been created, so they are sent in the same email)
+        send_todoist_errors([err, *errors])
         raise
-    else:
-        cleanup_lockfiles()
+
+
+def main():
+    import argparse  # pylint: disable=C0415
+
+    parser = argparse.ArgumentParser(description="Create Todoist tasks for the received emails.")
+    parser.add_argument(
+        "--profile", action="store_true", help="profile the run and write a speedscope file in the cache directory"
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    daemon_parser = subparsers.add_parser("daemon", help="watch the mailboxes instead of running once")
+    daemon_parser.add_argument(
+        "--gmail-interval", type=float, default=30, help="interval between the Gmail history polls (in seconds)"
+    )
+    daemon_parser.add_argument(
+        "--push-port", type=int, help="port of the local endpoint that receives the Gmail Pub/Sub push notifications"
+    )
+    cache_parser = subparsers.add_parser("cache", help="report the cached content that changed since the snapshot")
+    cache_parser.add_argument(
+        "--snapshot", action="store_true", help="save the current state of the cached content instead of reporting"
+    )
+    for command, description in (
+        ("record", "run once and record the responses of the servers to a cassette"),
+        ("replay", "run once with the responses of a cassette and print the Todoist commands instead of sending them"),
+    ):
+        subparsers.add_parser(command, help=description).add_argument(
+            "--cassette", type=Path, default=DEFAULT_CASSETTE, help=f"cassette file (default: {DEFAULT_CASSETTE})"
+        )
+    args = parser.parse_args()
+
+    if args.command == "cache":
+        import cache_store  # pylint: disable=C0415
+
+        if args.snapshot:
+            cache_store.snapshot()
+        else:
+            cache_store.report()
+        return
+
+    profiler = None
+    if args.profile:
+        from profiler import Profiler  # pylint: disable=C0415
+
+        profiler = Profiler().start()
+    try:
+        if args.command == "daemon":
+            from daemon import Daemon  # pylint: disable=C0415
+
+            Daemon(args.gmail_interval, args.push_port).run()
+            return
+
+        if args.command in ("record", "replay"):
+            cassette.start(args.command, args.cassette)
+        try:
+            run()
+        finally:
+            if cassette.active:
+                cassette.stop()
+            stats.report()
+    finally:
+        if profiler:
+            from profiler import profile_file  # pylint: disable=C0415
+
+            profiler.stop()
+            profiler.report()
+            file = profile_file(args.command or "run")
+            profiler.save(file)
+            print(f"Profile written to {file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""A cache of the raw content of the Gmail messages, in one compressed SQLite file per account."""
+
+import contextlib
+import typing
+import zlib
+from typing import Iterable
+
+from accounts import Account
+from cassette import cassette
+from stats import stats
+
+if typing.TYPE_CHECKING:
+    import sqlite3
+
+# The maximum number of parameters in an SQLite query
+MAX_VARIABLES = 500
+
+
+class MessageCache:
+    """
+    The raw content of the messages of an account, compressed with zlib.
+
+    The messages that are no longer in the inbox are removed by `prune`, so the size of the cache stays proportional
+    to the size of the inbox.
+
+    The cache is not read when a cassette is active, and not written when it is replayed.
+    """
+
+    def __init__(self, account: Account):
+        self.file = account.cache_dir / "messages.sqlite3"
+        self.legacy_dir = account.cache_dir
+
+    @contextlib.contextmanager
+    def connect(self) -> typing.Generator["sqlite3.Connection", None, None]:
+        """Open a connection to the cache (and commit the changes at the end)."""
+        import sqlite3  # pylint: disable=C0415
+
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        exists = self.file.exists()
+        with contextlib.closing(sqlite3.connect(self.file)) as conn, conn:
+            if not exists:
+                conn.execute("CREATE TABLE IF NOT EXISTS messages (id TEXT PRIMARY KEY, size INTEGER, content BLOB)")
+                self._import_legacy_files(conn)
+            yield conn
+
+    def _import_legacy_files(self, conn: "sqlite3.Connection"):
+        """Move the `message_<id>` files used by older versions to the cache."""
+        files = list(self.legacy_dir.glob("message_*"))
+        conn.executemany(
+            "INSERT OR REPLACE INTO messages VALUES (?, ?, ?)",
+            ((file.name.removeprefix("message_"), *self._compress(file.read_bytes())) for file in files),
+        )
+        conn.commit()
+        for file in files:
+            file.unlink()
+
+    @staticmethod
+    def _compress(content: bytes) -> tuple[int, bytes]:
+        return len(content), zlib.compress(content)
+
+    @staticmethod
+    def _chunks(ids: list[str]) -> Iterable[tuple[str, list[str]]]:
+        """Split a list of IDs in chunks that fit in a query, with the placeholders of each chunk."""
+        for i in range(0, len(ids), MAX_VARIABLES):
+            chunk = ids[i : i + MAX_VARIABLES]
+            yield ", ".join("?" * len(chunk)), chunk
+
+    def get(self, message_id: str) -> bytes | None:
+        """Return the content of a message, or None if it isn't cached."""
+        return self.get_many([message_id]).get(message_id)
+
+    def get_many(self, message_ids: Iterable[str]) -> dict[str, bytes]:
+        """Return the content of the cached messages among `message_ids` by message ID."""
+        contents: dict[str, bytes] = {}
+        if cassette.active:
+            return contents
+        with self.connect() as conn:
+            for placeholders, chunk in self._chunks(list(message_ids)):
+                for message_id, content in conn.execute(
+                    f"SELECT id, content FROM messages WHERE id IN ({placeholders})", chunk
+                ):
+                    contents[message_id] = zlib.decompress(content)
+        return contents
+
+    def put_many(self, contents: dict[str, bytes]):
+        """Add some messages to the cache."""
+        if cassette.replaying:
+            return
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?)",
+                ((message_id, *self._compress(content)) for message_id, content in contents.items()),
+            )
+
+    def delete(self, message_ids: Iterable[str]):
+        """Remove some messages from the cache."""
+        if cassette.replaying:
+            return
+        with self.connect() as conn:
+            for placeholders, chunk in self._chunks(list(message_ids)):
+                conn.execute(f"DELETE FROM messages WHERE id IN ({placeholders})", chunk)
+
+    def prune(self, message_ids: Iterable[str]):
+        """Remove the messages that are not in `message_ids` (all the messages in the inbox) from the cache."""
+        if cassette.replaying:
+            return
+        keep = set(message_ids)
+        with self.connect() as conn:
+            cached = [message_id for (message_id,) in conn.execute("SELECT id FROM messages")]
+            removed = [message_id for message_id in cached if message_id not in keep]
+            for placeholders, chunk in self._chunks(removed):
+                conn.execute(f"DELETE FROM messages WHERE id IN ({placeholders})", chunk)
+        if removed:
+            # Give the free pages back to the file system
+            with self.connect() as conn:
+                conn.execute("VACUUM")
+        stats.count("gmail.cache_pruned", len(removed))
+
+    def report(self):
+        """Add the number of cached messages and the size of the cache to the stats."""
+        if cassette.replaying:
+            return
+        with self.connect() as conn:
+            count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM messages").fetchone()
+        stats.count("gmail.cache_messages", count)
+        stats.count("gmail.cache_bytes", size)
+        stats.count("gmail.cache_file_bytes", self.file.stat().st_size)
@@ -1,69 +1,147 @@
 """Utility functions to manage OAuth access/refresh tokens."""
 
+import math
+import time
 from pathlib import Path
+from threading import RLock
+from typing import ClassVar
 
 import custom_requests
+from cassette import cassette
 from get_secrets import secrets
+from stats import stats
+
+# Validate or refresh the tokens again when they expire in less than this number of seconds
+EXPIRY_MARGIN = 120
+# Lifetime of a refreshed token if the provider doesn't give it
+DEFAULT_EXPIRES_IN = 3600
 
 
 class Token:
     """An OAuth2 access/refresh token to access a service."""
 
-    def __init__(self, access_token="", refresh_token="", *, provider: str, ensure_valid=True):
+    # The valid tokens of this process, by key
+    _cache: ClassVar[dict[str, "Token"]] = {}
+    _cache_lock = RLock()
+
+    def __init__(self, access_token="", refresh_token="", *, provider: str, account="", ensure_valid=True):
         self.access_token = access_token
         self.refresh_token = refresh_token
         self.provider = provider
+        # The name of the account (empty for the default account)
+        self.account = account
+        # The timestamp when the access token expires (None if unknown)
+        self.expires_at: float | None = None
 
         if ensure_valid:
-            self._ensure_valid()
+            with stats.timer("token.validate"):
+                self._ensure_valid()
+
+    @property
+    def key(self):
+        """The provider and the account of the token (used in the names of its secrets and files)."""
+        return self.key_for(self.provider, self.account)
+
+    @staticmethod
+    def key_for(provider: str, account=""):
+        return f"{provider}_{account}" if account else provider
 
     @property
     def file(self):
         """The file containing the token."""
-        return self.file_for_provider(self.provider)
+        return self.file_for_provider(self.provider, self.account)
 
     @staticmethod
-    def file_for_provider(provider):
-        return Path(__file__).parent / f"cache/.{provider}_token"
+    def file_for_provider(provider, account=""):
+        return Path(__file__).parent / f"cache/.{Token.key_for(provider, account)}_token"
+
+    @property
+    def expires_soon(self):
+        """True if the token is expired or will expire soon (or if we don't know), False otherwise."""
+        return self.expires_at is None or self.expires_at - EXPIRY_MARGIN <= time.time()
 
     def save(self):
         """Save the token to its file and the .env file."""
         if self.provider == "google":
-            secrets[f"{self.provider.upper()}_REFRESH_TOKEN"] = self.refresh_token
+            secrets[f"{self.key.upper()}_REFRESH_TOKEN"] = self.refresh_token
             self.file.parent.mkdir(parents=True, exist_ok=True)
             self.file.write_text(self.access_token)
 
         if self.provider == "todoist":
-            secrets[f"{self.provider.upper()}_TOKEN"] = self.access_token
+            secrets[f"{self.key.upper()}_TOKEN"] = self.access_token
+
+        # Forget the cached token if it is an older one
+        with self._cache_lock:
+            if self._cache.get(self.key) is not self:
+                self._cache.pop(self.key, None)
 
     @classmethod
-    def for_provider(cls, provider: str):
-        """Get the token from its file. If it doesn't exist, raise an error."""
-        file = Path(__file__).parent / f"cache/.{provider}_token"
+    def for_provider(cls, provider: str, account=""):
+        """
+        Get the token from the cache or from its file. If it doesn't exist, raise an error.
+
+        The token is only validated over the network if it is not cached or if it expires soon.
+        """
+        key = cls.key_for(provider, account)
+        # The lock only protects the cache: the tokens are validated outside of it, so the accounts don't wait for
+        # each other
+        with cls._cache_lock:
+            token = cls._cache.get(key)
+        if token is not None:
+            stats.hit("token.cache", not token.expires_soon)
+            if token.expires_soon:
+                with stats.timer("token.validate"):
+                    token._refresh()
+            return token
+
+        file = cls.file_for_provider(provider, account)
         if file.exists():
             access_token = file.read_text()
         else:
-            access_token = secrets.get(f"{provider.upper()}_TOKEN", "")
+            access_token = secrets.get(f"{key.upper()}_TOKEN", "")
 
         if provider == "google":
-            refresh_token = secrets.get(f"{provider.upper()}_REFRESH_TOKEN", "")
+            refresh_token = secrets.get(f"{key.upper()}_REFRESH_TOKEN", "")
         else:
             refresh_token = ""
 
-        if provider == "google" and not refresh_token or provider != "google" and not access_token:
-            raise RuntimeError(f"Can't find {provider} token")
+        missing = provider == "google" and not refresh_token or provider != "google" and not access_token
+        # The replayed requests don't need a real token
+        if missing and not cassette.replaying:
+            raise RuntimeError(f"Can't find {key} token")
 
-        return cls(access_token, refresh_token, provider=provider)
+        stats.hit("token.cache", False)
+        token = cls(access_token, refresh_token, provider=provider, account=account)
+        # Check the cache again: the validation has cached the token, unless another thread has cached one since
+        with cls._cache_lock:
+            return cls._cache.get(key, token)
 
     @classmethod
-    def delete(cls, provider: str):
+    def delete(cls, provider: str, account=""):
         """Delete the token for a given provider."""
-        secrets.pop(f"{provider.upper()}_TOKEN", "")
-        secrets.pop(f"{provider.upper()}_REFRESH_TOKEN", "")
-        cls.file_for_provider(provider).unlink(missing_ok=True)
+        key = cls.key_for(provider, account)
+        with secrets.batch():
+            secrets.pop(f"{key.upper()}_TOKEN", "")
+            secrets.pop(f"{key.upper()}_REFRESH_TOKEN", "")
+        cls.file_for_provider(provider, account).unlink(missing_ok=True)
+        with cls._cache_lock:
+            cls._cache.pop(key, None)
+
+    def invalidate(self):
+        """Validate the token again the next time it is used (e.g. after a 401 error)."""
+        self.expires_at = None
+
+    def revalidate(self):
+        """Validate the token again over the network, refreshing it if needed."""
+        with self._cache_lock, stats.timer("token.validate"):
+            self.invalidate()
+            self._ensure_valid()
 
     def _ensure_valid(self):
         """Ensure the token is valid by refreshing it if needed."""
+        if cassette.replaying:
+            self._set_valid(math.inf)
+            return
         # If the Google token is expired, check if it is still valid
         if self.provider == "google":
             try:
@@ -71,32 +149,38 @@ class Token:
                     "https://oauth2.googleapis.com/tokeninfo", {"access_token": self.access_token}
                 ).json()
                 # If the token is valid, stop here
+                self._set_valid(int(data.get("expires_in", 0)))
                 return
             except OSError:
                 pass
 
         if self.provider == "todoist":
-            # Check if the Todoist token is valid
+            # Check if the Todoist token is valid (we pass the raw access token to avoid retrying on 401 errors)
             try:
-                custom_requests.get("https://api.todoist.com/api/v1/user", token=self)
+                custom_requests.get("https://api.todoist.com/api/v1/user", token=self.access_token)
             except OSError as err:
                 raise ValueError("The Todoist token is invalid") from err
+            # Todoist tokens don't expire
+            self._set_valid(math.inf)
+            return
+
+        self._refresh()
 
+    def _refresh(self):
+        """Refresh the access token with the refresh token."""
         # Try to refresh the token
         token_refresh_url = {
             "google": "https://oauth2.googleapis.com/token",
         }.get(self.provider)
-        params = {
-            "google": {
-                "client_id": secrets[f"{self.provider.upper()}_CLIENT_ID"],
-                "client_secret": secrets[f"{self.provider.upper()}_CLIENT_SECRET"],
-                "refresh_token": self.refresh_token,
-                "grant_type": "refresh_token",
-            }
-        }.get(self.provider)
         # If there is nothing to do, stop here
-        if not token_refresh_url or not params:
+        if not token_refresh_url:
             return
+        params = {
+            "client_id": secrets[f"{self.provider.upper()}_CLIENT_ID"],
+            "client_secret": secrets[f"{self.provider.upper()}_CLIENT_SECRET"],
+            "refresh_token": self.refresh_token,
+            "grant_type": "refresh_token",
+        }
 
         try:
             data = custom_requests.post(token_refresh_url, params).json()
@@ -110,5 +194,12 @@ class Token:
 
         # Save the new access token
         self.access_token = data.get("access_token", "")
+        self._set_valid(int(data.get("expires_in", DEFAULT_EXPIRES_IN)))
 
         self.save()
+
+    def _set_valid(self, expires_in: float):
+        """Mark the token as valid for `expires_in` seconds and cache it."""
+        self.expires_at = time.time() + expires_in
+        with self._cache_lock:
+            self._cache[self.key] = self
@@ -0,0 +1,261 @@
+"""The steps of the pipeline that are shared by the single runs (`main.py`) and the daemon (`daemon.py`)."""
+
+import time
+from dataclasses import dataclass, field
+from typing import Iterable
+
+from cassette import cassette
+from email_parser import EmailParser
+from email_utils import Message
+from get_secrets import secrets
+from stats import stats
+from todoist import ID_COMMENT, Comment, SyncStatus, Task
+
+# Trust the cached Todoist data if it is more recent than this number of seconds (the workflow runs every 30 minutes)
+MAX_CACHE_AGE = float(secrets.get("TODOIST_MAX_CACHE_AGE", "3600"))
+
+
+def get_sync_status(max_age: float = MAX_CACHE_AGE) -> SyncStatus:
+    """Return a Todoist sync status with the project and the label of the automation (if they are set)."""
+    return SyncStatus(
+        ["items", "notes"],
+        max_age=max_age,
+        project_id=secrets.get("TODOIST_PROJECT_ID") or None,
+        label=secrets.get("TODOIST_LABEL") or None,
+    )
+
+
+def is_transient(err: Exception) -> bool:
+    """Return True if an error is a temporary server error that doesn't need to be reported."""
+    if isinstance(err, OSError):
+        err_to_check: BaseException | None = err
+        while err_to_check:
+            if any(message in str(err_to_check) for message in ("Bad Gateway", "Service Unavailable")):
+                return True
+            err_to_check = err_to_check.__context__
+    return False
+
+
+def send_todoist_errors(errors: list[Exception]):
+    """
+    Send one email with the errors of a run (or of a daemon cycle) to the user.
+
+    The errors that have already been sent recently (see `error_store.ERROR_EMAIL_WINDOW`) are skipped.
+    """
+    import html  # pylint: disable=C0415
+    import traceback  # pylint: disable=C0415
+
+    # Only needed when there are errors
+    from error_store import ErrorStore  # pylint: disable=C0415
+    from send_email import send_email  # pylint: disable=C0415
+
+    if cassette.replaying:
+        print("Error email not sent (replaying a cassette)")
+        return
+
+    with ErrorStore() as store:
+        # If we don't need to send the errors, stop here
+        errors = [err for err in errors if not is_transient(err) and not store.seen(err)]
+        if not errors:
+            print("Error email already sent")
+            return
+
+        if len(errors) == 1:
+            subject = "An error occurred while adding tasks to Todoist"
+        else:
+            subject = f"{len(errors)} errors occurred while adding tasks to Todoist"
+        message = f"{subject}:\n"
+        html_message = f"""\
+<!DOCTYPE html>
+<html>
+<head>
+<title>{subject}</title>
+</head>
+<body>
+<p>{subject}:</p>
+"""
+        for err in errors:
+            error = store.get(err)
+            seen = ""
+            if error["count"] > 1:
+                seen = f"(seen {error['count']} times since {time.ctime(error['first_seen'])})"
+            message += f"""
+{type(err).__name__}: {err} {seen}
+
+{"".join(traceback.format_exception(err))}
+"""
+            html_message += f"""\
+<p><b>{type(err).__name__}</b>: {html.escape(str(err))} {seen}</p>
+<pre>{html.escape("".join(traceback.format_exception(err)))}</pre>
+"""
+        html_message += """\
+</body>
+</html>
+"""
+        future = send_email(secrets["GMX_USER"], subject, message, html_message)
+        for err in errors:
+            store.sent(err)
+
+    def on_done(future):
+        if future.exception():
+            # Send the errors again next time
+            with ErrorStore() as store:
+                for err in errors:
+                    store.unsent(err)
+
+    # The email is sent in the background (and before the program exits)
+    future.add_done_callback(on_done)
+    print("Error email queued")
+
+
+def handle_message_list(
+    messages: Iterable[Message],
+    status: SyncStatus | None = None,
+    unchanged_hashed_ids: Iterable[str] = (),
+    listed_platforms: set[str] | None = None,
+):
+    """
+    Compare a message list with the message IDs present in the tasks and call the
+    `handle_new_message` and `handle_deleted_message` functions.
+
+    `unchanged_hashed_ids` are the hashed IDs of the messages that still exist but are not in `messages`
+    because they haven't changed (their tasks are kept as is).
+
+    `listed_platforms` are the platforms whose messages are all known (None for all): the tasks of the messages of
+    the other platforms are never closed.
+    """
+    if status is None:
+        status = get_sync_status()
+
+    # Only the tasks created by the automation can be linked to a message
+    tasks = Task.owned(status)
+
+    seen_hashed_message_ids: set[str] = set(unchanged_hashed_ids)
+
+    # Send the commands from a background thread while we handle the next messages
+    status.start_background_sync()
+    try:
+        # New messages
+        for message in messages:
+            print(f"Message: {message.hashed_id}")
+            seen_hashed_message_ids.add(message.hashed_id)
+            handle_new_message(message, tasks, status)
+            print()
+
+        # Deleted messages
+        check_deleted_messages(tasks, seen_hashed_message_ids, listed_platforms)
+    except BaseException:
+        status.stop_background_sync(flush=False)
+        raise
+
+    # Send the remaining changes to Todoist
+    status.stop_background_sync()
+
+
+def handle_new_message(message: Message, tasks: list[Task], status: SyncStatus):
+    """Handle a new message: create a task and remove the duplicate tasks."""
+    # The ID of an already created task about this message
+    old_task_id = None
+    for task in tasks:
+        for comment in task.get_id_comments():
+            if message.hashed_id in comment.content:
+                if old_task_id is None:
+                    # If it's the first task we see, save its ID to edit it
+                    print("    Task found")
+                    old_task_id = task.id
+                else:
+                    # Otherwise, delete the task because it's a duplicate
+                    task.delete()
+                    # Keep our list in sync with Todoist
+                    tasks.remove(task)
+                    print("    Duplicate task deleted")
+
+    if old_task_id is None:
+        print("    New message")
+
+    task = EmailParser.parse_email(message, status)
+    task._id = old_task_id
+    task.save()
+    tasks.append(task)
+
+    if not old_task_id:
+        Comment(task, f"ID : {message.hashed_id}", status=status).save()
+        print("    Task created")
+    else:
+        for comment in task.get_id_comments():
+            if message.hashed_id in comment.content:
+                break
+        else:
+            Comment(task, f"ID : {message.hashed_id}", status=status).save()
+        print("    Task updated")
+
+
+@dataclass
+class DeletionPlan:
+    """The tasks to close or delete because their messages have been deleted."""
+
+    # The first task of each deleted message
+    to_close: list[Task] = field(default_factory=list)
+    # The other tasks of the deleted messages (duplicates)
+    to_delete: list[Task] = field(default_factory=list)
+    # The hashed IDs of the deleted messages
+    deleted_hashed_ids: list[str] = field(default_factory=list)
+
+
+def plan_deleted_messages(
+    tasks: list[Task], seen_hashed_message_ids: set[str], listed_platforms: set[str] | None = None
+) -> DeletionPlan:
+    """
+    Find the tasks of the deleted messages (in one pass over the tasks).
+
+    Only the messages of `listed_platforms` (all the platforms if None) can be deleted.
+    """
+    plan = DeletionPlan()
+    # Hashed IDs of messages for which a task will be closed
+    closed: set[str] = set()
+    for task in tasks:
+        hashed_ids = [match[1] for comment in task.get_id_comments() if (match := ID_COMMENT.match(comment.content))]
+        # Keep the tasks that are linked to a message that still exists
+        if not hashed_ids or not seen_hashed_message_ids.isdisjoint(hashed_ids):
+            continue
+        # Keep the tasks of the platforms whose messages are not all known (the hashed IDs start with the platform)
+        if listed_platforms is not None and any(
+            hashed_id.partition("_")[0] not in listed_platforms for hashed_id in hashed_ids
+        ):
+            continue
+        new_hashed_ids = [hashed_id for hashed_id in hashed_ids if hashed_id not in closed]
+        plan.deleted_hashed_ids.extend(new_hashed_ids)
+        if len(new_hashed_ids) == len(hashed_ids):
+            # If no task has been closed for these messages, close this one
+            plan.to_close.append(task)
+        else:
+            # Otherwise, delete it
+            plan.to_delete.append(task)
+        closed.update(hashed_ids)
+    return plan
+
+
+def check_deleted_messages(
+    tasks: list[Task], seen_hashed_message_ids: set[str], listed_platforms: set[str] | None = None
+):
+    """Check for deleted messages and close or delete the associated tasks (of `listed_platforms`, if not None)."""
+    plan = plan_deleted_messages(tasks, seen_hashed_message_ids, listed_platforms)
+    for hashed_id in plan.deleted_hashed_ids:
+        print(f"Deleted message: {hashed_id}")
+
+    # The commands are sent together by the sync status
+    for task in plan.to_close:
+        task.close()
+    for task in plan.to_delete:
+        task.delete()
+    if plan.to_delete:
+        # Keep our list in sync with Todoist
+        deleted = {id(task) for task in plan.to_delete}
+        tasks[:] = [task for task in tasks if id(task) not in deleted]
+
+    stats.count("todoist.tasks_closed", len(plan.to_close))
+    stats.count("todoist.tasks_deleted", len(plan.to_delete))
+    print(
+        f"{len(plan.deleted_hashed_ids)} deleted messages: {len(plan.to_close)} tasks closed, "
+        f"{len(plan.to_delete)} duplicate tasks deleted"
+    )
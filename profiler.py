@@ -0,0 +1,146 @@
+"""
+A sampling profiler to find where the time of a run goes.
+
+The stacks of all the threads are sampled at regular intervals (unlike cProfile, which only sees the thread that
+started it), and each sample is assigned to a pipeline stage (fetch, parse, match, sync) with the innermost running
+`stats` timer of its thread. The samples are written to a speedscope file (https://www.speedscope.app/).
+"""
+
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from stats import stats
+
+# The pipeline stage of each timer (by the first part of its name, e.g. "gmail" for "gmail-alice" or "gmail.fetch")
+STAGES = {
+    "gmail": "fetch",
+    "gmx": "fetch",
+    "http": "fetch",
+    "token": "fetch",
+    "parse": "parse",
+    "match": "match",
+    "todoist": "sync",
+    "smtp": "report",
+}
+# The functions that wait for something else (their samples are not counted outside of a timer, e.g. idle workers)
+IDLE_FUNCTIONS = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+
+Frame = tuple[str, str, int]
+
+
+def get_stage(timer: str | None) -> str:
+    """Return the pipeline stage of a timer."""
+    if timer is None:
+        return "other"
+    return STAGES.get(timer.split(".")[0].split("-")[0], "other")
+
+
+class Profiler:
+    """Sample the stacks of the threads every `interval` seconds between `start` and `stop`."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        # The number of samples of each (stage, stack) pair, with the stacks from the outermost frame
+        self.samples: Counter[tuple[str, tuple[Frame, ...]]] = Counter()
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.start_time = self.end_time = 0.0
+
+    def start(self):
+        """Start sampling in a background thread."""
+        self.start_time = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling."""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        self.end_time = time.perf_counter()
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Record the stacks of the other threads."""
+        for thread_id, frame in sys._current_frames().items():  # pylint: disable=W0212
+            if thread_id == threading.get_ident():
+                continue
+            stack: list[Frame] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                frame = frame.f_back
+            # The innermost running timer (the list can change in its thread)
+            running = stats.running.get(thread_id, [])[-1:]
+            if not running and (Path(stack[0][0]).name, stack[0][1]) in IDLE_FUNCTIONS:
+                continue
+            self.samples[get_stage(running[0] if running else None), tuple(reversed(stack))] += 1
+
+    def save(self, file: Path):
+        """Write the samples to a speedscope file (the stages are the root frames)."""
+        frames: dict[Frame | str, int] = {}
+        samples = []
+        weights = []
+        for (stage, stack), count in self.samples.items():
+            samples.append([frames.setdefault(key, len(frames)) for key in (f"[{stage}]", *stack)])
+            weights.append(count * self.interval)
+        data = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": file.stem,
+            "exporter": "automation profiler",
+            "shared": {
+                "frames": [
+                    {"name": key} if isinstance(key, str) else {"name": key[1], "file": key[0], "line": key[2]}
+                    for key in frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": file.stem,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(json.dumps(data), "utf-8")
+
+    def report(self, top: int = 15):
+        """Print the time spent in each stage and the functions where the most time is spent."""
+        total = sum(self.samples.values())
+        print(f"Profile ({total} samples in {self.end_time - self.start_time:.3f} s, all threads)")
+        if not total:
+            return
+        by_stage: Counter[str] = Counter()
+        by_function: Counter[Frame] = Counter()
+        for (stage, stack), count in self.samples.items():
+            by_stage[stage] += count
+            by_function[stack[-1]] += count
+        print("    stages:")
+        for stage, count in by_stage.most_common():
+            print(f"        {stage:<8} {count / total:>6.1%} {count * self.interval:>8.3f} s")
+        print("    hotspots (self time):")
+        for (filename, name, line), count in by_function.most_common(top):
+            print(f"        {count / total:>6.1%} {count * self.interval:>8.3f} s  {name} ({filename}:{line})")
+
+
+def profile_file(name: str) -> Path:
+    """Return the file where the profile of a run is written."""
+    return Path(__file__).parent / f"cache/profile_{name}.speedscope.json"
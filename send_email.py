@@ -1,11 +1,153 @@
-import smtplib
-from email.message import EmailMessage
+"""Send emails from a background thread with a reusable SMTP session."""
+
+import atexit
+import queue
+import threading
+import typing
 
 from get_secrets import secrets
+from stats import stats
+
+if typing.TYPE_CHECKING:
+    import smtplib
+    from concurrent.futures import Future
+    from email.message import EmailMessage
+
+# Close the SMTP session after this number of seconds without a message to send
+IDLE_TIMEOUT = 60
+# The timeout of the SMTP socket operations
+SMTP_TIMEOUT = 60
+
+
+class Mailer:
+    """
+    Send the queued emails from a background thread, with one authenticated SMTP session for all of them.
+
+    The session is opened for the first message and closed after `idle_timeout` seconds without a message.
+    The queued messages are sent before the program exits.
+    """
+
+    def __init__(self, host: str = "mail.gmx.com", port: int = 465, use_ssl: bool = True, idle_timeout=IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.idle_timeout = idle_timeout
+        self.queue: queue.Queue[tuple[EmailMessage, Future[None]] | None] = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+
+    def send(self, msg: "EmailMessage") -> "Future[None]":
+        """Queue a message and return a future that is done when it is sent (or has failed)."""
+        from concurrent.futures import Future  # pylint: disable=C0415
+
+        future: Future[None] = Future()
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="mailer", daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+            self.queue.put((msg, future))
+        return future
+
+    def flush(self):
+        """Wait until all the queued messages are sent."""
+        self.queue.join()
 
+    def close(self):
+        """Send the queued messages, close the SMTP session and stop the background thread."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+            if thread is None:
+                return
+            atexit.unregister(self.close)
+            self.queue.put(None)
+        thread.join()
 
-def send_email(to, subject, message, html_message=""):
-    """Send an email."""
+    def run(self):
+        """Send the queued messages until `close` is called."""
+        server = None
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.idle_timeout if server else None)
+                except queue.Empty:
+                    server = self.quit(server)
+                    continue
+                try:
+                    if item is None:
+                        return
+                    msg, future = item
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        server = self.deliver(server, msg)
+                    except Exception as err:  # pylint: disable=W0718
+                        print(f"Error sending the email {msg['Subject']!r}: {err}")
+                        # Open a new session for the next message
+                        server = self.quit(server)
+                        future.set_exception(err)
+                    else:
+                        future.set_result(None)
+                finally:
+                    self.queue.task_done()
+        finally:
+            self.quit(server)
+
+    def connect(self) -> "smtplib.SMTP":
+        """Open an authenticated SMTP session."""
+        # Only import the SMTP modules when we need to send an email
+        import smtplib  # pylint: disable=C0415
+
+        with stats.timer("smtp.connect"):
+            smtp = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+            server = smtp(self.host, self.port, timeout=SMTP_TIMEOUT)
+        try:
+            with stats.timer("smtp.login"):
+                server.login(secrets["GMX_USER"], secrets["GMX_PASSWORD"])
+        except BaseException:
+            self.quit(server)
+            raise
+        return server
+
+    def deliver(self, server: "smtplib.SMTP | None", msg: "EmailMessage") -> "smtplib.SMTP":
+        """Send a message with the current session (or a new one) and return the session."""
+        import smtplib  # pylint: disable=C0415
+
+        if server is not None:
+            try:
+                with stats.timer("smtp.send"):
+                    server.send_message(msg)
+                stats.count("smtp.messages")
+                return server
+            except smtplib.SMTPServerDisconnected:
+                # The server has closed the session, send the message again with a new one
+                self.quit(server)
+        server = self.connect()
+        try:
+            with stats.timer("smtp.send"):
+                server.send_message(msg)
+        except BaseException:
+            self.quit(server)
+            raise
+        stats.count("smtp.messages")
+        return server
+
+    @staticmethod
+    def quit(server: "smtplib.SMTP | None") -> None:
+        """Close a session (if it is still open) and return None."""
+        if server is not None:
+            try:
+                server.quit()
+            except OSError:
+                server.close()
+
+
+mailer = Mailer()
+
+
+def send_email(to, subject, message, html_message="") -> "Future[None]":
+    """Queue an email and return a future that is done when it is sent."""
+    from email.message import EmailMessage  # pylint: disable=C0415
 
     msg = EmailMessage()
     msg.set_content(message)
@@ -14,7 +156,4 @@ def send_email(to, subject, message, html_message=""):
     msg["Subject"] = subject
     msg["From"] = secrets["GMX_USER"]
     msg["To"] = to
-
-    with smtplib.SMTP_SSL("mail.gmx.com", 465) as server:
-        server.login(secrets["GMX_USER"], secrets["GMX_PASSWORD"])
-        server.send_message(msg)
+    return mailer.send(msg)
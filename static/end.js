@@ -1,4 +1,4 @@
-window.addEventListener("DOMContentLoaded", async function() {
+window.addEventListener("DOMContentLoaded", function() {
     function addConfetti() {
         var script = document.createElement("script");
         script.src = "https://cdn.jsdelivr.net/npm/canvas-confetti@1";
@@ -18,9 +18,7 @@ window.addEventListener("DOMContentLoaded", async function() {
     var conclusionElement = document.querySelector(".conclusion");
     var loader = document.querySelector(".loader");
     var finalMessage = document.createElement("div");
-    async function check() {
-        var resp = await fetch("/status");
-        var data = await resp.json();
+    function update(data) {
         var status = data.status;
         statusElement.innerText = status;
         var conclusion = data.conclusion;
@@ -35,10 +33,13 @@ window.addEventListener("DOMContentLoaded", async function() {
         } else {
             return;
         }
-        clearInterval(intv);
+        // The server sends the changes of the status: stop listening when it is final
+        events.close();
         loader.remove();
         document.body.appendChild(finalMessage);
     }
-    var intv = setInterval(check, 5000);
-    await check();
+    var events = new EventSource("/status/stream");
+    events.addEventListener("message", function(event) {
+        update(JSON.parse(event.data));
+    });
 });
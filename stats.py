@@ -0,0 +1,101 @@
+"""Lightweight timers and counters to see where the time of a run goes."""
+
+import datetime as dt
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock, get_ident
+
+# The number of run summaries kept in `cache/stats.jsonl` (about 10 days of runs every 30 minutes)
+MAX_ENTRIES = 500
+
+
+class Stats:
+    """Timers and counters collected during a run."""
+
+    def __init__(self):
+        self.lock = Lock()
+        # The names of the running timers of each thread (the innermost one is the last), for the profiler
+        self.running: dict[int, list[str]] = defaultdict(list)
+        self.reset()
+
+    def reset(self):
+        """Forget all the collected timers and counters."""
+        with self.lock:
+            self.start = time.perf_counter()
+            self.durations: dict[str, float] = defaultdict(float)
+            self.calls: dict[str, int] = defaultdict(int)
+            self.counters: dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Measure the time spent in a block of code and add it to the `name` timer."""
+        running = self.running[get_ident()]
+        running.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            # The timers of concurrent coroutines can end in any order
+            del running[len(running) - 1 - running[::-1].index(name)]
+            with self.lock:
+                self.durations[name] += duration
+                self.calls[name] += 1
+
+    def count(self, name: str, value: int = 1):
+        """Add `value` to the `name` counter."""
+        with self.lock:
+            self.counters[name] += value
+
+    def hit(self, name: str, hit: bool):
+        """Record a cache hit or miss for the `name` cache."""
+        self.count(f"{name}.hits" if hit else f"{name}.misses")
+
+    def summary(self) -> dict:
+        """Return a JSON-serializable summary of the run."""
+        with self.lock:
+            hit_rates = {}
+            for key in self.counters:
+                if not key.endswith(".hits") and not key.endswith(".misses"):
+                    continue
+                name = key.rpartition(".")[0]
+                hits = self.counters.get(f"{name}.hits", 0)
+                total = hits + self.counters.get(f"{name}.misses", 0)
+                hit_rates[name] = round(hits / total, 3) if total else None
+            return {
+                "date": dt.datetime.now(dt.UTC).isoformat(),
+                "total": round(time.perf_counter() - self.start, 3),
+                "timers": {
+                    name: {"duration": round(duration, 3), "calls": self.calls[name]}
+                    for name, duration in sorted(self.durations.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+                "hit_rates": dict(sorted(hit_rates.items())),
+            }
+
+    def report(self, file: Path | None = None):
+        """Print the summary of the run and append it to the `cache/stats.jsonl` file (with the last `MAX_ENTRIES`)."""
+        summary = self.summary()
+
+        print(f"Run summary ({summary['total']:.3f} s)")
+        for name, timer in summary["timers"].items():
+            print(f"    {name}: {timer['duration']:.3f} s ({timer['calls']} calls)")
+        for name, value in summary["counters"].items():
+            print(f"    {name}: {value}")
+        for name, rate in summary["hit_rates"].items():
+            print(f"    {name} hit rate: {'-' if rate is None else f'{rate:.1%}'}")
+
+        if file is None:
+            file = Path(__file__).parent / "cache/stats.jsonl"
+        file.parent.mkdir(parents=True, exist_ok=True)
+        lines = file.read_text("utf-8").splitlines(keepends=True) if file.exists() else []
+        lines = [*lines[max(len(lines) - MAX_ENTRIES + 1, 0) :], json.dumps(summary, separators=(",", ":")) + "\n"]
+        new_file = file.with_name(file.name + ".new")
+        new_file.write_text("".join(lines), "utf-8")
+        new_file.replace(file)
+
+
+stats = Stats()
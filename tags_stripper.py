@@ -0,0 +1,19 @@
+"""A HTML parser that strips tags (in its own module because `html.parser` is only needed for HTML bodies)."""
+
+from html.parser import HTMLParser
+from io import StringIO
+
+
+class TagsStripper(HTMLParser):
+    """A HTML parser that strips tags."""
+
+    def __init__(self):
+        super().__init__()
+        self.text = StringIO()
+
+    def handle_data(self, data):
+        self.text.write(data)
+
+    def get_data(self):
+        """Return the text in the parsed HTML."""
+        return self.text.getvalue()
@@ -1,15 +1,24 @@
 """Utility functions to manage Todoist objects."""
 
 import abc
+import contextlib
 import datetime as dt
 import json
+import math
+import re
+import sys
+import threading
+import time
 import uuid
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any, Iterable, Self
 
 import custom_requests
+from cache_store import ContentStore
+from cassette import cassette
 from oauth_token import Token
+from stats import stats
 
 
 def to_json(data):
@@ -23,6 +32,84 @@ def to_json(data):
 MAX_SIZE = 1_048_576
 # https://developer.todoist.com/sync/v9/#maximum-sync-commands
 MAX_COMMANDS = 100
+# Time to wait for other commands before sending them from the background thread (in seconds)
+FLUSH_INTERVAL = 2
+# Maximum number of pending commands before `add_command` waits for the background thread
+MAX_PENDING_COMMANDS = 4 * MAX_COMMANDS
+# The version of the local replica format (older replicas are fetched again)
+REPLICA_VERSION = 3
+# The comment that links a task to the message it was created from
+ID_COMMENT = re.compile(r"^ID : (.*?)$")
+
+
+class Record:
+    """
+    A compact representation of a Todoist object that only keeps the fields we use.
+
+    The full JSON data of the object is kept on disk (see `SyncStatus.raw`).
+    """
+
+    __slots__ = ()
+    fields: tuple[str, ...] = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> Self:
+        """Create a record from the data provided by Todoist."""
+        return cls.from_list([data[name] for name in cls.fields])
+
+    @classmethod
+    def from_list(cls, values: list[Any]) -> Self:
+        """Create a record from its representation in the local replica."""
+        # The IDs are repeated in other objects (e.g. `Note.item_id`), so we share them
+        return cls(*(sys.intern(value) if name.endswith("id") else value for name, value in zip(cls.fields, values)))
+
+    def to_list(self) -> list[Any]:
+        """Return the representation of the record in the local replica."""
+        return [getattr(self, name) for name in self.fields]
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.fields)})"
+
+
+class Item(Record):
+    """A compact Todoist item."""
+
+    __slots__ = fields = ("id", "content", "description", "due", "project_id", "labels")
+    id: str
+    content: str
+    description: str
+    # The due date as an ISO string
+    due: str | None
+    project_id: str
+    labels: list[str]
+
+    @classmethod
+    def from_json(cls, data):
+        return cls.from_list([
+            data["id"],
+            data["content"],
+            data["description"],
+            (data["due"] or {}).get("date"),
+            data["project_id"],
+            data.get("labels", []),
+        ])
+
+
+class Note(Record):
+    """A compact Todoist note (comment)."""
+
+    __slots__ = fields = ("id", "item_id", "content")
+    id: str
+    item_id: str
+    content: str
+
+
+# The resource types that are stored as records (by ID) instead of raw JSON data
+RECORD_TYPES: dict[str, type[Record]] = {"items": Item, "notes": Note}
 
 
 @dataclass
@@ -31,74 +118,359 @@ class SyncStatus:
 
     # The resource types that we want to receive
     resource_types: list[str] = field(default_factory=lambda: ["all"])
-    # The pending commands (we use a dict to avoid duplicate actions)
-    commands: dict[str, Any] = field(init=False, default_factory=dict)
+    # If the cached data is more recent than this number of seconds, don't get the changes when the status is created
+    # (they will be received with the first commands)
+    max_age: float = 0
+    # If set, only the tasks in this project (or with this label) are considered as created by the automation,
+    # and the new tasks are created in this project (or with this label)
+    project_id: str | None = None
+    label: str | None = None
+    # The pending commands, by object ID and kind of command (we use a dict to merge duplicate actions)
+    commands: dict[tuple[str, str], dict[str, Any]] = field(init=False, default_factory=dict)
     # The objects that have temporary IDs that will be mapped to real IDs
     temp_ids: dict[str, "TodoistObject"] = field(init=False, default_factory=dict)
 
     def __post_init__(self):
-        self.file = Path(__file__).parent / f"cache/todoist_status_{'_'.join(self.resource_types)}.json"
-        if self.file.exists():
-            self.data = json.loads(self.file.read_text("utf-8"))
+        # All the statuses share the same local replica, whatever resource types they need:
+        # the sync token is in this file and the objects are in the content store (one chunk per resource type)
+        self.file = Path(__file__).parent / "cache/todoist_status.json"
+        self.store = ContentStore("todoist")
+        # The full JSON data of the objects stored as records
+        self.raw_file = self.file.with_name("todoist_raw.sqlite3")
+        # With a cassette, start from an empty replica to get the same requests when recording and replaying
+        data = None if cassette.active else self._load() or self._load_legacy_file()
+        data = data or {"sync_token": "*", "resource_types": []}
+        data["version"] = REPLICA_VERSION
+        self.data: dict[str, Any] = self._load_records(data)
+        # The ID comments (by note ID) of each item that has one, to find the tasks created by the automation
+        self.id_notes = self._index_id_notes({}, ((None, note) for note in self.data.get("notes", {}).values()))
+        # The real IDs of the temporary IDs that have already been synced
+        self.resolved_ids: dict[str, str] = {}
+        # The total size of the pending commands in JSON
+        self.commands_size = 0
+        # Protects the pending commands (and wakes up the background thread)
+        self.lock = threading.Condition()
+        # Only one request is sent at a time
+        self.sync_lock = threading.Lock()
+        self.worker: threading.Thread | None = None
+        self.stopping = False
+        self.first_command_time = 0.0
+        # An error raised in the background thread (raised again in the main thread)
+        self.error: Exception | None = None
+
+        missing_resource_types = self.missing_resource_types
+        if missing_resource_types:
+            self._fetch(missing_resource_types)
+
+        if self.age < self.max_age:
+            stats.hit("todoist.cache", True)
+        else:
+            stats.hit("todoist.cache", False)
+            self.sync()
+
+    def _load(self) -> dict[str, Any] | None:
+        """Load the local replica (None if there is no usable replica)."""
+        data = json.loads(self.file.read_text("utf-8")) if self.file.exists() else None
+        if data is None:
+            return None
+        if data.get("version") == 2:
+            # The objects used to be in the same file as the sync token
+            return data
+        if data.get("version") != REPLICA_VERSION:
+            return None
+        try:
+            for key, chunk in data.pop("chunks").items():
+                data[key] = json.loads(self.store.get(chunk))
+        except FileNotFoundError:
+            # The content store hasn't been restored with the sync token
+            print("Some Todoist data is missing from the cache, getting everything again")
+            return None
+        return data
+
+    def _load_legacy_file(self) -> dict[str, Any] | None:
+        """Load the data from an old `todoist_status_<resource types>.json` file and remove the old files."""
+        data = None
+        for file in sorted(self.file.parent.glob("todoist_status_*.json")):
+            if data is None:
+                data = json.loads(file.read_text("utf-8"))
+                data["resource_types"] = file.stem.removeprefix("todoist_status_").split("_")
+            file.unlink()
+        return data
+
+    @staticmethod
+    def _load_records(data: dict[str, Any]) -> dict[str, Any]:
+        """Convert the objects of the local replica to records."""
+        for key, record_type in RECORD_TYPES.items():
+            if key in data:
+                data[key] = {
+                    record.id: record
+                    for record in (
+                        # Older files contain the raw JSON data
+                        record_type.from_json(obj) if isinstance(obj, dict) else record_type.from_list(obj)
+                        for obj in data[key]
+                    )
+                }
+        return data
+
+    @staticmethod
+    def _index_id_notes(
+        index: dict[str, dict[str, Note]], changes: Iterable[tuple[Note | None, Note | None]]
+    ) -> dict[str, dict[str, Note]]:
+        """Return a copy of the index of the ID comments updated with (old note, new note) pairs (None if absent)."""
+        index = dict(index)
+        for old, new in changes:
+            if old and old.id in index.get(old.item_id, {}):
+                notes = index[old.item_id] = dict(index[old.item_id])
+                del notes[old.id]
+                if not notes:
+                    del index[old.item_id]
+            if new and ID_COMMENT.match(new.content):
+                index[new.item_id] = {**index.get(new.item_id, {}), new.id: new}
+        return index
+
+    def owns(self, item: Item) -> bool:
+        """Return True if an item is in the project and has the label of the automation (if they are set)."""
+        return (self.project_id is None or item.project_id == self.project_id) and (
+            self.label is None or self.label in item.labels
+        )
+
+    def owned_items(self) -> list[tuple[Item, dict[str, Note]]]:
+        """Return the items created by the automation (the ones with an ID comment) with their ID comments."""
+        items = self.data.get("items", {})
+        return [
+            (items[item_id], notes)
+            for item_id, notes in self.id_notes.items()
+            if item_id in items and self.owns(items[item_id])
+        ]
+
+    def raw(self, key: str, id: str) -> dict[str, Any] | None:
+        """Return the full JSON data of an object stored as a record (e.g. `raw("items", task_id)`)."""
+        import sqlite3  # pylint: disable=C0415
+
+        if cassette.replaying or not self.raw_file.exists():
+            return None
+        with contextlib.closing(sqlite3.connect(self.raw_file)) as conn:
+            row = conn.execute("SELECT data FROM objects WHERE key = ? AND id = ?", (key, id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save_raw(self, data: dict[str, Any]):
+        """Save the full JSON data of the objects that are stored as records."""
+        import sqlite3  # pylint: disable=C0415
+
+        if cassette.replaying:
+            return
+        self.raw_file.parent.mkdir(parents=True, exist_ok=True)
+        with contextlib.closing(sqlite3.connect(self.raw_file)) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS objects (key TEXT, id TEXT, data TEXT, PRIMARY KEY (key, id))")
+            for key in RECORD_TYPES:
+                conn.executemany(
+                    "DELETE FROM objects WHERE key = ? AND id = ?",
+                    ((key, obj["id"]) for obj in data.get(key, []) if obj.get("is_deleted")),
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO objects VALUES (?, ?, ?)",
+                    ((key, obj["id"], to_json(obj)) for obj in data.get(key, []) if not obj.get("is_deleted")),
+                )
+
+    @property
+    def missing_resource_types(self) -> list[str]:
+        """The resource types that we need but that are not in the local replica."""
+        held = self.data["resource_types"] if self.data["sync_token"] != "*" else []
+        if "all" in held:
+            return []
+        if "all" in self.resource_types:
+            # Get everything except what we already have
+            return ["all", *(f"-{resource_type}" for resource_type in held)]
+        return [resource_type for resource_type in self.resource_types if resource_type not in held]
+
+    def _fetch(self, resource_types: list[str]):
+        """Get all the objects of some resource types and add them to the local replica."""
+        print(f"Getting the Todoist {', '.join(resource_types)}")
+        with stats.timer("todoist.sync"):
+            stats.count("todoist.syncs")
+            data = custom_requests.post(
+                "https://api.todoist.com/api/v1/sync",
+                data={"sync_token": "*", "resource_types": to_json(resource_types)},
+                token=Token.for_provider("todoist"),
+            ).json()
+
+        held = self.data["resource_types"] if self.data["sync_token"] != "*" else []
+        if held:
+            # Keep the old sync token: the next sync will get the changes of the other resource types since then
+            # (and the changes of the new ones, which doesn't harm)
+            del data["sync_token"]
+            data.pop("full_sync", None)
+            data["synced_at"] = self.data.get("synced_at", 0)
         else:
-            self.data: dict[str, Any] = {"sync_token": "*"}
-        self.sync()
+            data["synced_at"] = time.time()
+        data["resource_types"] = ["all"] if "all" in resource_types else [*held, *resource_types]
+        self._merge(data)
+        self._save()
+
+    @property
+    def age(self):
+        """The number of seconds since the last sync (infinite if we never synced)."""
+        if self.data["sync_token"] == "*":
+            return math.inf
+        return time.time() - self.data.get("synced_at", 0)
 
     def sync(self):
-        """Sync the changes with the Todoist API."""
+        """Send all the pending commands to the Todoist API and get the changes."""
+        with stats.timer("todoist.sync"):
+            while not self._sync_batch():
+                pass
+
+    def _sync_batch(self, allow_empty=True):
+        """Send one batch of pending commands. Return True if there are no more pending commands."""
+        self._raise_error()
+        with self.sync_lock:
+            with self.lock:
+                batch = self._take_batch()
+                done = not self.commands
+                # Wake up the threads that are waiting for free space
+                self.lock.notify_all()
+            if batch or allow_empty:
+                self._send(batch)
+        return done
+
+    def _take_batch(self):
+        """Remove the commands that fit in one request from the pending commands and return them."""
+        batch: list[dict[str, Any]] = []
+        size = 2
+        for key, command in list(self.commands.items()):
+            command_size = len(to_json(command)) + 1
+            if len(batch) >= MAX_COMMANDS or batch and size + command_size > MAX_SIZE:
+                break
+            batch.append(command)
+            size += command_size
+            self.commands_size -= command_size
+            del self.commands[key]
+        return batch
+
+    def _resolve(self, command: dict[str, Any]):
+        """Replace the temporary IDs that have already been synced by their real ID in the command arguments."""
+        command["args"] = {
+            key: self.resolved_ids.get(value, value) if isinstance(value, str) else value
+            for key, value in command["args"].items()
+        }
+        return command
+
+    def _send(self, batch: list[dict[str, Any]]):
+        """Send a batch of commands to the Todoist API and merge the changes into the local data."""
+        stats.count("todoist.syncs")
+        stats.count("todoist.commands", len(batch))
+        if cassette.replaying:
+            # Don't change anything on Todoist
+            for command in batch:
+                print(f"Todoist command: {to_json(self._resolve(command))}")
+            return
         data = custom_requests.post(
             "https://api.todoist.com/api/v1/sync",
             data={
                 "sync_token": self.data["sync_token"],
-                "resource_types": to_json(self.resource_types),
-                "commands": to_json(self.commands.values()),
+                # Keep all the resource types of the replica up to date (they share the same sync token)
+                "resource_types": to_json(self.data["resource_types"]),
+                "commands": to_json(self._resolve(command) for command in batch),
             },
             token=Token.for_provider("todoist"),
         ).json()
-        for key, value in data.items():
-            if key in ("sync_status", "temp_id_mapping", "sync_token", "full_sync") or not isinstance(value, list):
-                self.data[key] = value
-                continue
-
-            for item in value:
-                self.data.setdefault(key, [])
-                to_delete: list[int] = []
-                for i, old_item in enumerate(self.data[key]):
-                    if old_item["id"] == item["id"]:
-                        if item["is_deleted"]:
-                            to_delete.append(i)
-                        else:
-                            self.data[key][i] = item
-                        break
-                else:
-                    self.data[key].append(item)
-                for i in to_delete[::-1]:
-                    del self.data[key][i]
 
-        for temp_id, id in self.data["temp_id_mapping"].items():
-            self.temp_ids[temp_id]._id = id
+        sync_status = data.pop("sync_status", {})
+        temp_id_mapping = data.pop("temp_id_mapping", {})
 
-        sync_status = self.data.setdefault("sync_status", {})
+        data["synced_at"] = time.time()
+        self._merge(data)
 
-        self.temp_ids = {}
-        self.commands = {}
+        with self.lock:
+            for temp_id, id in temp_id_mapping.items():
+                self.resolved_ids[temp_id] = id
+                if temp_id in self.temp_ids:
+                    self.temp_ids.pop(temp_id)._id = id
 
-        del self.data["sync_status"]
-        del self.data["temp_id_mapping"]
-
-        self.file.parent.mkdir(parents=True, exist_ok=True)
-        self.file.write_text(to_json(self.data))
+        self._save()
 
+        commands = {command["uuid"]: command for command in batch}
         for id, value in sync_status.items():
             if value == "ok":
                 continue
+            # The object may have been deleted on Todoist after our last sync (if we trusted the cache)
+            if id in commands and self._deleted_remotely(commands[id]):
+                print(f"Sync operation {id} skipped: the object has been deleted ({value['error']})")
+                continue
             raise RuntimeError(f"Sync operation {id} failed with error code {value['error_code']} ({value['error']})")
 
+    def _merge(self, data: dict[str, Any]):
+        """Merge the data received from the Todoist API into the local replica."""
+        if any(data.get(key) for key in RECORD_TYPES):
+            self._save_raw(data)
+
+        new_data = dict(self.data)
+        id_notes = self.id_notes
+        for key, value in data.items():
+            if not isinstance(value, list) or key == "resource_types":
+                new_data[key] = value
+                continue
+
+            if key in RECORD_TYPES:
+                records = dict(new_data.get(key, {}))
+                changes = []
+                for obj in value:
+                    old = records.pop(obj["id"], None)
+                    if not obj.get("is_deleted"):
+                        records[obj["id"]] = RECORD_TYPES[key].from_json(obj)
+                    changes.append((old, records.get(obj["id"])))
+                new_data[key] = records
+                if key == "notes":
+                    id_notes = self._index_id_notes(id_notes, changes)
+                continue
+
+            objects = {obj["id"]: obj for obj in new_data.get(key, [])}
+            for obj in value:
+                if obj.get("is_deleted"):
+                    objects.pop(obj["id"], None)
+                else:
+                    objects[obj["id"]] = obj
+            new_data[key] = list(objects.values())
+        # Replace the data at once because it can be read from another thread
+        self.id_notes = id_notes
+        self.data = new_data
+
+    def _save(self):
+        """
+        Save the local replica: the objects of each resource type in a chunk of the content store (which is only
+        written if they have changed) and the sync token with the keys of the chunks in the replica file.
+        """
+        if cassette.replaying:
+            return
+        state: dict[str, Any] = {"version": REPLICA_VERSION, "chunks": {}}
+        for key, value in self.data.items():
+            if key in RECORD_TYPES:
+                state["chunks"][key] = self.store.put(to_json(record.to_list() for record in value.values()).encode())
+            elif isinstance(value, (list, dict)) and key != "resource_types":
+                state["chunks"][key] = self.store.put(to_json(value).encode())
+            else:
+                state[key] = value
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        new_file = self.file.with_name(self.file.name + ".new")
+        new_file.write_text(to_json(state))
+        new_file.replace(self.file)
+        # Remove the chunks of the previous versions
+        self.store.gc(state["chunks"].values())
+
+    def _deleted_remotely(self, command: dict[str, Any]):
+        """Return True if the object of a command is not in the data we received, False otherwise."""
+        object_type, _, action = command["type"].partition("_")
+        key = f"{object_type}s"
+        if action == "add" or key not in self.data or "id" not in command["args"]:
+            return False
+        if key in RECORD_TYPES:
+            return command["args"]["id"] not in self.data[key]
+        return all(obj["id"] != command["args"]["id"] for obj in self.data[key])
+
     def add_command(self, obj: "TodoistObject", obj_type: str, args: dict[str, Any] | None = None):
         """Add a command to be synced with the Todoist API."""
-        # Generate an temporary ID by accessing the property; if the object has one, save it
-        if obj.temp_id:
-            self.temp_ids[obj.temp_id] = obj
+        self._raise_error()
+        # Generate an temporary ID by accessing the property
         to_add = {
             "type": obj_type,
             **({"temp_id": obj.temp_id} if obj.temp_id else {}),
@@ -109,13 +481,94 @@ class SyncStatus:
             },
         }
         # If this object exceeds the maximum size, raise an error
-        len_to_add = len(to_json(to_add)) + (1 if self.commands else 2)  # length of the comma or brackets
-        if len_to_add > MAX_SIZE:
+        if len(to_json(to_add)) + 2 > MAX_SIZE:
             raise ValueError("Payload too big")
-        # If all the commands will exceed the maximum size or if there are too many commands, sync now
-        if len(to_json(self.commands.values())) + len_to_add >= MAX_SIZE or len(self.commands) >= MAX_COMMANDS:
+
+        with self.lock:
+            # If the background thread is late, wait for it
+            while self.worker and len(self.commands) >= MAX_PENDING_COMMANDS and not self.error:
+                self.lock.wait()
+            self._raise_error()
+
+            if obj.temp_id:
+                self.temp_ids[obj.temp_id] = obj
+
+            # Merge the updates of the same object into the pending add or update command
+            kind = "save" if obj_type.endswith(("_add", "_update")) else obj_type
+            key = (obj.id, kind)
+            if key in self.commands:
+                old = self.commands[key]
+                self.commands_size -= len(to_json(old)) + 1
+                if kind == "save":
+                    to_add = {**old, "args": {**old["args"], **to_add["args"]}}
+                stats.count("todoist.coalesced_commands")
+            self.commands[key] = to_add
+            self.commands_size += len(to_json(to_add)) + 1
+
+            if len(self.commands) == 1:
+                self.first_command_time = time.monotonic()
+            full = len(self.commands) >= MAX_COMMANDS or self.commands_size >= MAX_SIZE
+            if self.worker:
+                self.lock.notify_all()
+
+        # If there are too many commands (or if they are too big), sync now
+        if full and not self.worker:
             self.sync()
-        self.commands[obj.id] = to_add
+
+    def start_background_sync(self, interval: float = FLUSH_INTERVAL):
+        """
+        Send the commands from a background thread when there are enough of them or after `interval` seconds,
+        so that the caller doesn't wait for the requests.
+
+        Call `stop_background_sync` (or `sync`) to send the remaining commands.
+        """
+        if self.worker:
+            return
+        self.stopping = False
+        self.worker = threading.Thread(target=self._background_sync, args=(interval,), daemon=True)
+        self.worker.start()
+
+    def stop_background_sync(self, flush=True):
+        """Stop the background thread and send the remaining commands (if `flush` is True)."""
+        if self.worker:
+            with self.lock:
+                self.stopping = True
+                self.lock.notify_all()
+            self.worker.join()
+            self.worker = None
+        if flush:
+            self.sync()
+
+    def _background_sync(self, interval: float):
+        while True:
+            with self.lock:
+                while not self.commands and not self.stopping:
+                    self.lock.wait()
+                if self.stopping:
+                    return
+                # Wait for other commands until the batch is full or the interval has passed
+                while len(self.commands) < MAX_COMMANDS and self.commands_size < MAX_SIZE and not self.stopping:
+                    remaining = self.first_command_time + interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.lock.wait(remaining)
+                if self.stopping:
+                    return
+            try:
+                with stats.timer("todoist.sync"):
+                    # The commands may have been sent by `sync` in the meantime
+                    self._sync_batch(allow_empty=False)
+            except Exception as err:  # pylint: disable=W0718
+                with self.lock:
+                    self.error = err
+                    self.lock.notify_all()
+                return
+
+    def _raise_error(self):
+        """Raise the error of the background thread in the current thread."""
+        if self.error and threading.current_thread() is not self.worker:
+            err, self.error = self.error, None
+            raise err
 
 
 # https://stackoverflow.com/a/72715549
@@ -162,13 +615,18 @@ class TodoistObject:
     def data(self) -> dict[str, Any]:
         """The Todoist data representation associated with this object."""
 
+    @property
+    def add_data(self) -> dict[str, Any]:
+        """The Todoist data used to create this object (fields that can't be updated can be added here)."""
+        return self.data
+
     def save(self):
         """Add or update the current object."""
         self._saving = True
         if self._id:
             self.status.add_command(self, f"{self.object_type}_update", {"id": self._id, **self.data})
         else:
-            self.status.add_command(self, f"{self.object_type}_add", self.data)
+            self.status.add_command(self, f"{self.object_type}_add", self.add_data)
         self._saving = False
 
 
@@ -192,21 +650,34 @@ class Task(TodoistObject):
             "priority": self.priority,
         }
 
+    @property
+    def add_data(self):
+        return {
+            **self.data,
+            **({"project_id": self.status.project_id} if self.status.project_id else {}),
+            **({"labels": [self.status.label]} if self.status.label else {}),
+        }
+
     @classmethod
-    def from_todoist(cls, data, status: SyncStatus) -> Self:
+    def from_todoist(cls, item: Item, status: SyncStatus) -> Self:
         """Create a `Task` from the data provided by Todoist."""
         return cls(
             status=status,
-            _id=data["id"],
-            title=data["content"],
-            description=data["description"],
-            due=dt.datetime.fromisoformat(data["due"]["date"]) if data["due"] else None,
+            _id=item.id,
+            title=item.content,
+            description=item.description,
+            due=dt.datetime.fromisoformat(item.due) if item.due else None,
         )
 
     @classmethod
     def all(cls, status: SyncStatus):
         """Return the list of all tasks."""
-        return [cls.from_todoist(data, status) for data in status.data["items"]]
+        return [cls.from_todoist(item, status) for item in status.data["items"].values()]
+
+    @classmethod
+    def owned(cls, status: SyncStatus):
+        """Return the list of the tasks created by the automation."""
+        return [cls.from_todoist(item, status) for item, _ in status.owned_items()]
 
     def close(self):
         """Close the current task."""
@@ -219,11 +690,18 @@ class Task(TodoistObject):
     def get_all_comments(self):
         """Return all the comments on the current task."""
         ret: list[Comment] = []
-        for item in self.status.data["notes"]:
-            if item["item_id"] == self.id:
-                ret.append(Comment(_id=item["id"], status=self.status, task=self, content=item["content"]))
+        for note in self.status.data["notes"].values():
+            if note.item_id == self.id:
+                ret.append(Comment(_id=note.id, status=self.status, task=self, content=note.content))
         return ret
 
+    def get_id_comments(self):
+        """Return the comments that link the current task to a message."""
+        return [
+            Comment(_id=note.id, status=self.status, task=self, content=note.content)
+            for note in self.status.id_notes.get(self.id, {}).values()
+        ]
+
 
 @dataclass
 class Comment(TodoistObject):